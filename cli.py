@@ -0,0 +1,168 @@
+import argparse
+import sys
+from pathlib import Path
+from utils.logging import logging
+
+
+def index(args: argparse.Namespace) -> int:
+    """Resolves context and chapter of every highlight ahead of time,
+    so the interface only reads them from the cache database."""
+    from utils.database import get_list_of_highlighted_books
+    from utils.library_index import index_library
+
+    filenames = [filename for _, _, filename in get_list_of_highlighted_books()]
+    if args.book:
+        filenames = [filename for filename in filenames if args.book in filename]
+    logging.debug("Indexing %s books with %s workers", len(filenames), args.workers or 'default')
+
+    failed = 0
+    for report in index_library(filenames, workers=args.workers, force=args.force):
+        print(f"{report.seconds:7.2f}s  {report.filename}: "
+              f"{report.resolved} resolved, {report.already_indexed} already indexed, "
+              f"{len(report.failures)} failed (of {report.highlights})")
+        for highlight_id, reason in report.failures:
+            print(f"          {highlight_id}: {reason}")
+        failed += len(report.failures)
+    return 1 if failed else 0
+
+
+def sync(args: argparse.Namespace) -> int:
+    """Imports the highlights created, edited or deleted since the last sync,
+    reading the device's database directly (or a consistent snapshot of it)"""
+    from utils.const import DATABASE_PATH
+    from utils.database import sync_kobo_mirror
+    from utils.kobo_mirror import take_snapshot
+
+    source = args.device
+    if args.snapshot:
+        take_snapshot(args.device, DATABASE_PATH)
+        source = DATABASE_PATH
+    changes = sync_kobo_mirror(source)
+    print(f"{len(changes.changed)} highlights new or changed, {len(changes.deleted)} deleted")
+    for highlight_id in changes.deleted:
+        print(f"  deleted: {highlight_id}")
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    """Turns every highlight that isn't a tiddler yet into one,
+    titled after its first words"""
+    from utils.database import get_list_of_highlighted_books
+    from utils.tiddler_export import export_library
+
+    filenames = [filename for _, _, filename in get_list_of_highlighted_books()]
+    if args.book:
+        filenames = [filename for filename in filenames if args.book in filename]
+    logging.debug("Exporting the highlights of %s books", len(filenames))
+
+    if args.bundle:
+        from utils.tiddler_bundle import JsonBundleSink
+        with JsonBundleSink(args.bundle) as sink:
+            failed = print_export_reports(export_library(
+                filenames, tags=args.tags.split(), workers=args.workers, sink=sink.write))
+        print(f"{sink.count} tiddlers written to {args.bundle}")
+    else:
+        failed = print_export_reports(export_library(
+            filenames, tags=args.tags.split(), workers=args.workers))
+    return 1 if failed else 0
+
+
+def print_export_reports(reports) -> int:
+    """Prints what was exported of each book, and returns how many highlights failed"""
+    failed = 0
+    for report in reports:
+        if not report.exported and not report.failures:
+            continue
+        print(f"{report.seconds:7.2f}s  {report.book_title or report.filename}: "
+              f"{len(report.exported)} exported, {report.already_exported} already exported, "
+              f"{len(report.failures)} failed")
+        for title in report.exported:
+            print(f"          {title}")
+        for highlight_id, reason in report.failures:
+            print(f"          {highlight_id}: {reason}")
+        failed += len(report.failures)
+    return failed
+
+
+def covers(args: argparse.Namespace) -> int:
+    """Extracts the cover of every highlighted book into the wiki's files,
+    skipping the ones already extracted"""
+    from utils.const import BOOKS_DIR
+    from utils.database import get_list_of_highlighted_books
+    from utils.retrieve_cover_from_epub import extract_covers
+    from utils.metadata_mappings import get_mapped_title_and_author
+
+    books = []
+    for title, author, filename in get_list_of_highlighted_books():
+        if Path(BOOKS_DIR + filename).exists():
+            # named after the title its book tiddler has
+            title, _ = get_mapped_title_and_author(filename, title, author)
+            books.append((BOOKS_DIR + filename, title))
+
+    for book_name, cover_filename in extract_covers(books, workers=args.workers):
+        print(f"{book_name}: {cover_filename or 'no cover'}")
+    return 0
+
+
+def startup(args: argparse.Namespace) -> int:
+    """Measures cold start: what importing the main screen costs
+    (`-X importtime`), and how long until its first frame is shown"""
+    from utils.startup_benchmark import run_startup_benchmark
+
+    report = run_startup_benchmark(runs=args.runs)
+    print(f"imports: {report.import_seconds:.3f}s, heaviest:")
+    for module, seconds in report.heaviest_imports:
+        print(f"  {seconds:.3f}s  {module}")
+    print("first frame: " + ", ".join(f"{seconds:.3f}s" for seconds in report.first_frame_seconds))
+    print(f"median {report.median_first_frame:.3f}s (budget {args.budget:.3f}s)")
+    return 0 if report.within_budget(args.budget) else 1
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='kobogarden')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    index_parser = subcommands.add_parser('index', help='pre-resolve every highlight of the library')
+    index_parser.add_argument('--workers', type=int, default=None,
+                              help='number of processes (defaults to the number of CPUs)')
+    index_parser.add_argument('--book', help='only index books whose filename contains this')
+    index_parser.add_argument('--force', action='store_true',
+                              help='resolve again highlights that are already indexed')
+    index_parser.set_defaults(run=index)
+
+    export_parser = subcommands.add_parser('export', help='create tiddlers for every highlight not yet exported')
+    export_parser.add_argument('--book', help='only export books whose filename contains this')
+    export_parser.add_argument('--tags', default='', help='space separated tags for the quote tiddlers')
+    export_parser.add_argument('--workers', type=int, default=None,
+                               help='threads writing the tiddlers of a book')
+    export_parser.add_argument('--bundle', metavar='PATH',
+                               help='write a single JSON file to import in TiddlyWiki, instead of .tid files')
+    export_parser.set_defaults(run=export)
+
+    covers_parser = subcommands.add_parser('covers', help='extract the cover of every highlighted book')
+    covers_parser.add_argument('--workers', type=int, default=None,
+                               help='threads extracting covers')
+    covers_parser.set_defaults(run=covers)
+
+    from utils.const import KOBO_DEVICE_DB_PATH
+    sync_parser = subcommands.add_parser('sync', help='import highlights changed on the device since the last sync')
+    sync_parser.add_argument('--device', default=KOBO_DEVICE_DB_PATH,
+                             help=f'the Kobo database on the device (defaults to {KOBO_DEVICE_DB_PATH})')
+    sync_parser.add_argument('--snapshot', action='store_true',
+                             help='first copy it with the sqlite backup API, and sync from the copy')
+    sync_parser.set_defaults(run=sync)
+
+    from utils.const import STARTUP_BUDGET_SECONDS
+    startup_parser = subcommands.add_parser('startup', help='measure how long kobogarden takes to start')
+    startup_parser.add_argument('--runs', type=int, default=5,
+                                help='cold starts to take the median of (defaults to 5)')
+    startup_parser.add_argument('--budget', type=float, default=STARTUP_BUDGET_SECONDS,
+                                help=f'fail above this many seconds (defaults to {STARTUP_BUDGET_SECONDS})')
+    startup_parser.set_defaults(run=startup)
+
+    args = parser.parse_args(argv)
+    return args.run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
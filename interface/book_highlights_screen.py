@@ -1,36 +1,34 @@
 from textual.app import ComposeResult
-from textual.widgets import OptionList, Static, Header
+from textual.widgets import Static, Header
 from textual import events
 from textual.screen import Screen
 from textual.widgets.option_list import Option
 from rich.table import Table
 from utils.const import (
-        VIM_BINDINGS,
         BOOKS_DIR,
-        TIDDLERS_PATH
+        TIDDLERS_PATH,
+        LIST_PAGE_SIZE
         )
 from utils.database import (
         BookNotFoundError,
-        get_all_highlights_of_book_from_database
+        get_page_of_highlight_records
         )
 from utils.tiddler_handling import (
     record_in_highlight_id,
     TiddlerFilenameManager
 )
 from utils.toc_handling import (
-    get_table_of_contents_from_epub,
-    match_highlight_section_to_chapter
+    get_chapter_of_highlight
         )
 from utils.logging import logging
+from utils.prefetch import prefetcher, warm_highlight
 from interface.book_metadata_modal import BookMetadataModal
+from interface.paged_option_list import PagedOptionList
 from textual.binding import Binding
 
 
-class QuotesList(OptionList):
-    BINDINGS = VIM_BINDINGS
-
-    def __init__(self, *options: Option) -> None:
-        super().__init__(*options)
+class QuotesList(PagedOptionList):
+    pass
 
 
 class BookHighlightsScreen(Screen):
@@ -57,7 +55,6 @@ class BookHighlightsScreen(Screen):
         
         # Get latest metadata from TiddlerFilenameManager
         manager = TiddlerFilenameManager()
-        manager.refresh_metadata()
         mapped_title, mapped_author = manager.get_mapped_metadata(book_metadata["filename"])
         
         # Use mapped values if available, otherwise use original metadata
@@ -74,26 +71,35 @@ class BookHighlightsScreen(Screen):
         # Set the screen's subtitle to show book info
         self.sub_title = f"{title} by {author}"
         
-        logging.debug(f"Initializing BookHighlightsScreen with metadata: {self.book_metadata}")
+        logging.debug("Initializing BookHighlightsScreen with metadata: %s", self.book_metadata)
         self.highlight_option = highlight_option
         self.highlight_option_id = highlight_option_id
-        
+
+    def fetch_highlights_page(self, after) -> tuple[list, tuple | None]:
+        """A page of the book's highlights, as options (see `PagedOptionList`)"""
         try:
             # Load highlights from database using filename
-            self.highlights = get_all_highlights_of_book_from_database(self.book_metadata["filename"])
-            if not self.highlights:
-                logging.info(f"No highlights found for book: {self.book_metadata['filename']}")
-                self.highlights = []
-            self.book_toc = get_table_of_contents_from_epub(BOOKS_DIR + self.book_metadata["filename"])
+            records = get_page_of_highlight_records(self.book_metadata["filename"], after)
+            if not records and after is None:
+                logging.info("No highlights found for book: %s", self.book_metadata['filename'])
+        # (this runs in a worker thread; see `PagedOptionList`)
         except BookNotFoundError as e:
-            logging.error(f"Book not found: {str(e)}")
+            logging.error("Book not found: %s", e)
             self.original_filename = None
-            self.highlights = []
-            self.notify("Book not found in database", severity="error")
+            self.app.call_from_thread(self.notify, "Book not found in database", severity="error")
+            return [], None
         except Exception as e:
-            logging.error(f"Error loading highlights: {str(e)}")
-            self.highlights = []
-            self.notify("Error loading highlights", severity="error")
+            logging.error("Error loading highlights: %s", e)
+            self.app.call_from_thread(self.notify, "Error loading highlights", severity="error")
+            return [], None
+        book_path = BOOKS_DIR + self.book_metadata["filename"]
+        options = [self.highlight_generator(record.text, record.date_created,
+                                            record.bookmark_id, record.start_container_path,
+                                            book_path=book_path)
+                   for record in records]
+        next_key = ((records[-1].date_created, records[-1].bookmark_id)
+                    if len(records) == LIST_PAGE_SIZE else None)
+        return options, next_key
 
     @staticmethod
     def highlight_generator(
@@ -101,9 +107,15 @@ class BookHighlightsScreen(Screen):
             date: str,
             highlight_id: str,
             container_path: str,
-            book_toc: str) -> Table:
+            book_path: str) -> Table:
         if highlight:
-            chapter = match_highlight_section_to_chapter(container_path, book_toc)
+            # the TOC is only parsed for highlights whose chapter isn't cached yet
+            try:
+                chapter = get_chapter_of_highlight(highlight_id, container_path, book_path)
+            # (eg. the epub isn't in BOOKS_DIR; the highlight is still listed)
+            except Exception as e:
+                logging.warning("No chapter for highlight %s: %s", highlight_id, e)
+                chapter = None
             table = Table(show_header=False)
             table.add_row(date.split('T')[0] + ' | ' +
                           str('✅' if record_in_highlight_id(highlight_id)
@@ -113,19 +125,31 @@ class BookHighlightsScreen(Screen):
             return Option(table, id=highlight_id)
 
     def compose(self) -> ComposeResult:
-        highlights = [self.highlight_generator(*highlight_info,
-                                               book_toc=self.book_toc)
-                      for highlight_info in self.highlights]
-        self.quotes_list = QuotesList(*highlights)
+        # highlights are fetched in the background, a page at a time,
+        # as the cursor moves down the list
+        self.quotes_list = QuotesList(self.fetch_highlights_page)
         if self.highlight_option_id:
-            self.quotes_list.highlighted = self.highlight_option_id
+            self.quotes_list.highlight_when_loaded(self.highlight_option_id)
         yield Header()
         yield self.quotes_list
 
+    def on_option_list_option_highlighted(self, event: QuotesList.OptionHighlighted) -> None:
+        # the highlight the cursor rests on, and then its neighbours,
+        # are the likeliest to be opened next
+        if event.option_list is not self.quotes_list:
+            return
+        prefetcher.cancel()
+        index = event.option_index
+        for neighbour in (index, index + 1, index - 1):
+            if 0 <= neighbour < self.quotes_list.option_count:
+                option = self.quotes_list.get_option_at_index(neighbour)
+                if option.id:
+                    prefetcher.submit(('highlight', option.id), warm_highlight, option.id)
+
     def on_key(self, event: events.Key) -> None:
         if event.key == "q":
             self.dismiss()
-        elif event.key == "enter":
+        elif event.key == "enter" and self.quotes_list.highlighted is not None:
             selected_highlight_option = self.quotes_list._options[self.quotes_list.highlighted]
             self.dismiss(['H', {
                 "book_option": self.book_option,
@@ -136,11 +160,11 @@ class BookHighlightsScreen(Screen):
 
     async def action_edit_metadata(self) -> None:
         """Handle the metadata editing action."""
-        logging.info(f"Opening metadata modal with current metadata: {self.book_metadata}")
+        logging.info("Opening metadata modal with current metadata: %s", self.book_metadata)
         
         def check_modal_result(result: dict | None) -> None:
             """Handle the modal result"""
-            logging.info(f"Modal callback received result: {result}")
+            logging.info("Modal callback received result: %s", result)
             
             if result is not None:
                 try:
@@ -153,10 +177,10 @@ class BookHighlightsScreen(Screen):
                     # Update current screen's metadata
                     self.book_metadata = result
                     self.sub_title = f"{result['title']} by {result['author']}"
-                    logging.info(f"Successfully updated metadata: {self.book_metadata}")
+                    logging.info("Successfully updated metadata: %s", self.book_metadata)
                     self.notify("Book metadata updated successfully", severity="success")
                 except Exception as e:
-                    logging.error(f"Failed to update metadata mapping: {str(e)}")
+                    logging.error("Failed to update metadata mapping: %s", e)
                     self.notify("Failed to save metadata changes", severity="error")
             else:
                 logging.info("Metadata update cancelled by user")
@@ -41,7 +41,7 @@ class BookMetadataModal(ModalScreen[dict]):
             author=self.query_one("#author-input").value,
             filename=self.book_metadata["filename"]
         )
-        logging.info(f"Modal: Submitting metadata via action: {new_metadata}")
+        logging.info("Modal: Submitting metadata via action: %s", new_metadata)
         self.dismiss(new_metadata)
 
     def action_cancel(self) -> None:
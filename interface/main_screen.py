@@ -1,27 +1,22 @@
 from textual import events
 from textual.app import App, ComposeResult
-from textual.widgets import Header, Footer, OptionList
+from textual.widgets import Header, Footer
 from textual.widgets.option_list import Option
-from interface.book_highlights_screen import BookHighlightsScreen
-from interface.single_highlight_screen import (
-    SingleHighlightScreen,
-        )
+from interface.paged_option_list import PagedOptionList
 from utils.const import (
-    DATABASE_PATH,
     OPTIONS_CSS_PATH,
-    VIM_BINDINGS
+    LIST_PAGE_SIZE
         )
 from utils.database import (
-    get_list_of_highlighted_books,
+    get_page_of_highlighted_books,
     )
 from utils.logging import logging
+from utils.metadata_mappings import get_mapped_title_and_author
+from utils.prefetch import prefetcher, warm_book
 
 
-class BookList(OptionList):
-    BINDINGS = VIM_BINDINGS
-
-    def __init__(self, *options: Option) -> None:
-        super().__init__(*options)
+class BookList(PagedOptionList):
+    pass
 
 
 class MainScreen(App[None]):
@@ -34,37 +29,54 @@ class MainScreen(App[None]):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)  
         self.current_book = None
-        self.books = get_list_of_highlighted_books(DATABASE_PATH)
-        self.books_metadata = {
-            f"{title} by {author}": {
+        # filled in a page at a time, as the book list fetches them
+        self.books_metadata = {}
+        self.selected_highlight = None  # Store selected highlight info
+
+    def fetch_books_page(self, after) -> tuple[list[Option], tuple | None]:
+        """A page of the highlighted books, as options (see `PagedOptionList`);
+        runs in a worker thread"""
+        books = get_page_of_highlighted_books(after)
+        options = []
+        for kobo_title, kobo_author, filename, _, _ in books:
+            # as the book was renamed in the metadata modal, if it was
+            title, author = get_mapped_title_and_author(filename, kobo_title, kobo_author)
+            self.books_metadata[f"{title} by {author}"] = {
                 "title": title,
                 "author": author,
                 "filename": filename
             }
-            for title, author, filename in self.books
-        }
-        logging.debug(f"Initialized MainScreen with {len(self.books)} books")
-        self.selected_highlight = None  # Store selected highlight info
+            options.append(Option(f"{title} by {author}", id=kobo_title))
+        logging.debug("Fetched a page of %s books", len(books))
+        next_key = (books[-1][3], books[-1][4]) if len(books) == LIST_PAGE_SIZE else None
+        return options, next_key
 
     def compose(self) -> ComposeResult:
-    # Create options using the same display format
-        self.book_options = [
-            Option(f"{title} by {author}", id=title)
-            for title, author, _ in self.books
-        ]
-
         # Store the OptionList instance as an attribute
-        # self.option_list = BookList(*books)
-        self.book_list = BookList(*self.book_options)
+        self.book_list = BookList(self.fetch_books_page)
         yield Header()
         yield self.book_list
         yield Footer()
 
+    def on_option_list_option_highlighted(self, event: BookList.OptionHighlighted) -> None:
+        # the book the cursor rests on is the likeliest to be opened next
+        if event.option_list is not getattr(self, 'book_list', None):
+            return
+        metadata = self.books_metadata.get(event.option.prompt)
+        if metadata:
+            prefetcher.cancel()
+            prefetcher.submit(('book', metadata["filename"]), warm_book, metadata["filename"])
+
     def on_key(self, event: events.Key) -> None:
+        # the other screens (and the epub parsers they use) are only
+        # imported once they are needed, so the book list shows up sooner
+        from interface.book_highlights_screen import BookHighlightsScreen
+        from interface.single_highlight_screen import SingleHighlightScreen
+
         def check_highlights_panel_quit(options: list | None):
             """Helper function to determine outcomes of different screens"""
             next_screen, content = options
-            logging.debug(f"screen_callback_content:\n{content}")
+            logging.debug("screen_callback_content:\n%s", content)
             if next_screen == 'H':
                 self.push_screen(SingleHighlightScreen("single_highlight", **content),
                                  check_highlights_panel_quit)
@@ -74,7 +86,7 @@ class MainScreen(App[None]):
                                  check_highlights_panel_quit)
 
         # a book has been chosen on the main panel
-        if event.key == "enter":
+        if event.key == "enter" and self.book_list.highlighted is not None:
             selected_book_index = self.book_list.highlighted
             selected_book_option = self.book_list._options[selected_book_index]
             self.push_screen(BookHighlightsScreen("book_highlights",
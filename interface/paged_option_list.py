@@ -0,0 +1,99 @@
+from typing import Any, Callable, Optional
+from textual import work
+from textual.widgets import OptionList
+from textual.widgets.option_list import Option
+from textual.worker import get_current_worker
+from utils.const import (
+        LIST_PREFETCH_MARGIN,
+        VIM_BINDINGS
+        )
+
+# given the key of the last row fetched so far (None for the first page),
+# returns the options of the next page and the key to fetch the one after it
+# (None once there are no more pages); it runs in a worker thread.
+PageFetcher = Callable[[Optional[Any]], tuple[list[Option | None], Optional[Any]]]
+
+# `highlight_when_loaded` target meaning "the last option"
+LAST_OPTION = -1
+
+
+class PagedOptionList(OptionList):
+    """An OptionList that only fetches and builds its options a page at a time,
+    in a thread worker: the first page when it's mounted (showing a loading
+    state until then), and the next one whenever the cursor gets close to the
+    last option. Opening it takes the same time however long the list is,
+    and keys are never blocked waiting on the database."""
+
+    BINDINGS = VIM_BINDINGS
+
+    def __init__(self, fetch_page: PageFetcher) -> None:
+        super().__init__()
+        self._fetch_page = fetch_page
+        self._next_key = None
+        self._first_page_loaded = False
+        self._page_loading = False
+        self._target = None
+
+    @property
+    def has_more_pages(self) -> bool:
+        return not self._first_page_loaded or self._next_key is not None
+
+    def on_mount(self) -> None:
+        self.loading = True
+        # the screen is painted first, and only then queried for
+        self.call_after_refresh(self.load_next_page)
+
+    def on_unmount(self) -> None:
+        # a page still being fetched is of no use anymore
+        self.workers.cancel_node(self)
+
+    def load_next_page(self) -> None:
+        if self._page_loading or not self.has_more_pages:
+            return
+        self._page_loading = True
+        self._fetch_in_background(self._next_key)
+
+    @work(thread=True, exclusive=True, group="pages")
+    def _fetch_in_background(self, key: Optional[Any]) -> None:
+        worker = get_current_worker()
+        options, next_key = self._fetch_page(key)
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self._add_page, options, next_key)
+
+    def _add_page(self, options: list[Option | None], next_key: Optional[Any]) -> None:
+        self._first_page_loaded = True
+        self._page_loading = False
+        self._next_key = next_key
+        self.loading = False
+        if options:
+            self.add_options(options)
+        if self._target is not None:
+            self._go_to_target()
+
+    def _go_to_target(self) -> None:
+        if self._target == LAST_OPTION or self.option_count <= self._target:
+            if self.has_more_pages:
+                self.load_next_page()
+                return
+        if self.option_count:
+            self.highlighted = (self.option_count - 1 if self._target == LAST_OPTION
+                                else min(self._target, self.option_count - 1))
+        self._target = None
+
+    def highlight_when_loaded(self, index: int) -> None:
+        """Highlights the option at `index`, once the pages up to it are fetched"""
+        self._target = index
+        if self._first_page_loaded:
+            self._go_to_target()
+
+    def on_option_list_option_highlighted(self, event: OptionList.OptionHighlighted) -> None:
+        if (event.option_list is self and self.highlighted is not None
+                and self.highlighted >= self.option_count - LIST_PREFETCH_MARGIN):
+            self.load_next_page()
+
+    def action_last(self) -> None:
+        # the last option is the last one of the last page
+        if self.has_more_pages:
+            self.highlight_when_loaded(LAST_OPTION)
+        else:
+            super().action_last()
@@ -1,14 +1,15 @@
-import traceback
 from datetime import datetime
 from textual.app import ComposeResult
 from textual.widget import Widget
 from textual.widgets import Footer, Header, Input, Button, Label, TextArea
-from textual import events
+from textual import events, work
 from textual.message import Message
 from textual.screen import Screen
 from textual.reactive import reactive
 from textual.containers import VerticalScroll, Vertical, ScrollableContainer
 from textual.binding import Binding
+from textual.css.query import NoMatches
+from textual.worker import get_current_worker
 from textual.widgets.option_list import Option
 from rich.text import Text
 from utils.const import (
@@ -16,7 +17,7 @@ from utils.const import (
     BOOKS_DIR
         )
 from utils.database import (
-        get_highlight_from_database,
+        get_highlight_record,
         )
 from utils.tiddler_handling import (
     add_highlight_id_to_record,
@@ -28,8 +29,7 @@ from utils.highlight_handling import (
         expand_found_highlight
         )
 from utils.toc_handling import (
-    get_table_of_contents_from_epub,
-    match_highlight_section_to_chapter
+    get_chapter_of_highlight
         )
 from utils.logging import logging
 
@@ -105,8 +105,7 @@ class TiddlerInformationWidget(Widget, can_focus=True):
                 self.notify("Failed to create tiddler", severity="error")
                 
         except Exception as e:
-            logging.error(f"Error creating tiddler: {str(e)}")
-            logging.error(traceback.format_exc())
+            logging.error("Error creating tiddler: %s", e, exc_info=True)
             self.notify(f"Error creating tiddler: {str(e)}", severity="error")
 
 
@@ -274,23 +273,17 @@ class SingleHighlightScreen(Screen):
         self.book_metadata = book_metadata
         self.highlight_option = highlight_option
         self.highlight_option_id = highlight_option_id
-        logging.debug(f"options are: \n{self.book_option}\n{self.highlight_option}")
+        logging.debug("options are: \n%s\n%s", self.book_option, self.highlight_option)
         self.highlight_id = highlight_option.id
         # TODO this is CSS should not be here
         self.styles.layout = 'horizontal'
-        # TODO refactor this part
-        info = get_highlight_from_database(self.highlight_id)
-        _, _, _, _, section, path = info
-        book_toc = get_table_of_contents_from_epub(BOOKS_DIR + path)
-        self.chapter = match_highlight_section_to_chapter(section, book_toc)
-        self.closed_highlight = get_highlight_context_from_id(self.highlight_id)
-        self.soup = get_full_context_from_highlight(BOOKS_DIR + path,
-                                                    section.split('#')[0])
+        self.chapter = None
+        self.closed_highlight = None
+        self.soup = None
 
     def compose(self) -> ComposeResult:
-        with VerticalScroll(id="display"):
-            yield SingleHighlightWidget(self.closed_highlight,
-                                        self.soup)
+        # the highlight is shown once `load_highlight` has it
+        yield VerticalScroll(id="display")
         with Vertical(id="controls"):
             yield TiddlerInformationWidget(self.book_metadata,
                                            self.highlight_id,
@@ -298,10 +291,53 @@ class SingleHighlightScreen(Screen):
         yield Header()
         yield Footer()
 
+    def on_mount(self) -> None:
+        self.query_one("#display").loading = True
+        self.load_highlight()
+
+    def on_unmount(self) -> None:
+        # nothing left to show the highlight on
+        self.workers.cancel_node(self)
+
+    @work(thread=True, exclusive=True)
+    def load_highlight(self) -> None:
+        """Reads the highlight's section and finds it there, off the event loop"""
+        worker = get_current_worker()
+        try:
+            # the record was already loaded with the highlights list,
+            # so none of this goes to the database again
+            record = get_highlight_record(self.highlight_id)
+            chapter = get_chapter_of_highlight(self.highlight_id,
+                                               record.start_container_path,
+                                               BOOKS_DIR + record.filename)
+            if worker.is_cancelled:
+                return
+            closed_highlight = get_highlight_context_from_id(self.highlight_id)
+            soup = get_full_context_from_highlight(BOOKS_DIR + record.filename,
+                                                   record.section)
+        except Exception as e:
+            logging.error("Error loading highlight %s", self.highlight_id, exc_info=True)
+            if not worker.is_cancelled:
+                self.app.call_from_thread(self.notify, f"Error loading highlight: {e}",
+                                          severity="error")
+            return
+        if not worker.is_cancelled:
+            self.app.call_from_thread(self.show_highlight, chapter, closed_highlight, soup)
+
+    def show_highlight(self, chapter: str, closed_highlight: list[str], soup: str) -> None:
+        self.chapter = chapter
+        self.closed_highlight = closed_highlight
+        self.soup = soup
+        self.query_one(TiddlerInformationWidget).chapter = chapter
+        display = self.query_one("#display")
+        display.loading = False
+        display.mount(SingleHighlightWidget(closed_highlight, soup))
+
     def on_key(self, event: events.Key) -> None:
         # return to the book highlight screen
         if event.key == "q":
-            logging.debug(f"quit S.HIGH screen with\n{self.book_option}\n{self.highlight_option}")
+            logging.debug("quit S.HIGH screen with\n%s\n%s",
+                          self.book_option, self.highlight_option)
             self.dismiss(['B', {
                 "book_option": self.book_option,
                 "book_metadata": self.book_metadata,
@@ -309,7 +345,7 @@ class SingleHighlightScreen(Screen):
                 "highlight_option_id": self.highlight_option_id
                                 }])
         elif event.key == "t":
-            logging.debug(self.highlight)
+            logging.debug("%s", self.highlight)
         else:
             try:
                 if event.key == "b":
@@ -328,7 +364,8 @@ class SingleHighlightScreen(Screen):
                     self.query_one(SingleHighlightWidget).extend_quote_below(True)
                 if event.key == "K":
                     self.query_one(SingleHighlightWidget).contract_quote_below(True)
-            except IndexError:
+            # (or the highlight hasn't been loaded yet)
+            except (IndexError, NoMatches):
                 pass
 
 
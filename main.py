@@ -5,3 +5,7 @@ from utils.logging import logging
 if __name__ == "__main__":
     logging.debug("Started kobogarden! 🪴")
     MainScreen().run()
+    # the book tiddlers' `nbr_of_highlights` are caught up with
+    # the quotes created during the session, all at once
+    from utils.tiddler_handling import update_book_tiddlers
+    update_book_tiddlers()
@@ -1,4 +1,13 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 import sqlite3
 from ebooklib import epub
 from datetime import datetime
@@ -7,17 +16,45 @@ from utils.database import (
         get_highlight_from_database,
         get_all_highlights_of_book_from_database,
         get_list_of_highlighted_books,
+        get_highlight_records_of_book,
+        sync_kobo_mirror,
+        get_page_of_highlight_records,
+        get_page_of_highlighted_books,
+        get_highlight_container_paths_from_database,
+        KoboConnectionPool,
         )
 from utils.tiddler_handling import (
     produce_highlight_tiddler_string,
     produce_book_tiddler_string,
+    HighlightIdRegistry,
+    TiddlerDirectoryIndex,
     create_book_tiddler
 )
 from utils.highlight_handling import (
         get_full_context_from_highlight,
         get_start_and_end_of_highlight,
         expand_found_highlight,
+        break_string_into_list_of_sentences,
+        get_index_of_sentence_in_sentences_list,
+        get_start_and_end_of_highlights,
+        get_highlight_offsets_from_container_paths,
+        get_highlight_location_from_id,
         )
+from utils.point_path import parse_point_path
+from utils.highlight_locator import AUTOMATON_MIN_FRAGMENTS, locate_fragments
+from utils.sentence_index import SentenceIndex
+from utils import cache_store, database, kobo_mirror
+from utils.cache_store import get_section_text
+from utils.epub_cache import get_parsed_book, get_epub_fingerprint
+from utils.epub_reader import EpubZipReader, get_epub_reader
+from utils.epub_validation import validate_epub_structure
+from utils.library_index import index_book, index_library
+from utils.prefetch import Prefetcher
+from utils.tiddler_bundle import JsonBundleSink
+from utils.metadata_mappings import MetadataMappingStore
+from utils.sqlite_pool import SQLiteConnectionPool, close_connection_pools
+from utils.retrieve_cover_from_epub import extract_cover_from_epub, extract_covers
+from utils import tiddler_export, tiddler_handling, tiddler_state
 from utils.const import (
     SQLITE_DB_PATH,
     SQLITE_DB_NAME,
@@ -27,7 +64,10 @@ from utils.toc_handling import (
     retrieve_clean_href,
     get_dict_of_href_and_title_from_toc,
     match_highlight_section_to_chapter,
-    get_previous_chapter_from_section
+    get_previous_chapter_from_section,
+    ChapterIndex,
+    get_chapter_index,
+    get_chapter_of_highlight
 )
 
 TEST_BOOKS_DIR = 'test_books/'
@@ -41,6 +81,28 @@ TEST_EPUB_SHALLOWS = 'shallows.epub'
 TEST_EPUB_STRANGERS = 'strangers.epub'
 
 
+# the cache database is kept out of the way while testing
+def setUpModule():
+    global cache_dir
+    cache_dir = tempfile.TemporaryDirectory()
+    cache_patch = mock.patch('utils.cache_store.CACHE_DB_PATH',
+                             cache_dir.name + '/cache.sqlite')
+    cache_patch.start()
+    mirror_patch = mock.patch('utils.kobo_mirror.KOBO_MIRROR_DB_PATH',
+                              cache_dir.name + '/kobo_mirror.sqlite')
+    mirror_patch.start()
+    state_patch = mock.patch('utils.tiddler_state.TIDDLER_STATE_DB_PATH',
+                             cache_dir.name + '/tiddler_state.sqlite')
+    state_patch.start()
+    close_connection_pools()
+
+
+def tearDownModule():
+    close_connection_pools()
+    mock.patch.stopall()
+    cache_dir.cleanup()
+
+
 class TestingKoboDatabase(unittest.TestCase):
     def test_can_open_kobo_database(self):
         conn = create_connection_to_database(SQLITE_DB_PATH + SQLITE_DB_NAME)
@@ -317,7 +379,711 @@ class TestingBookTableOfContents(unittest.TestCase):
 
 
 
+# 26/10/18: opening a single highlight used to parse the same epub
+# three or four times; now it's parsed once per session.
+class TestingParsedBookCache(unittest.TestCase):
+    def test_same_book_is_only_parsed_once(self):
+        first = get_parsed_book(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        second = get_parsed_book(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        self.assertIs(first, second)
+
+    def test_validation_only_needs_the_opf(self):
+        # BOOKS_DIR is ignored when the path is absolute
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        self.assertEqual(validate_epub_structure(book_path),
+                         (True, "Valid epub structure"))
+
+
+# 26/10/18: the section text is stored after the first extraction,
+# so BeautifulSoup only runs once per section.
+class TestingSectionTextStore(unittest.TestCase):
+    SECTION = 'OEBPS/4134408533708019941_1260-h-24.htm.html'
+
+    def test_section_text_is_stored_on_first_use(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        fingerprint = get_epub_fingerprint(book_path)
+        self.assertIsNone(get_section_text(book_path, self.SECTION, fingerprint))
+        soup = get_full_context_from_highlight(book_path, self.SECTION)
+        self.assertIn('CHAPTER XXII', soup)
+        self.assertEqual(get_section_text(book_path, self.SECTION, fingerprint), soup)
+
+    def test_changed_epub_misses_the_store(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        section = 'OEBPS/4134408533708019941_1260-h-23.htm.html'
+        get_full_context_from_highlight(book_path, section)
+        self.assertIsNone(get_section_text(book_path, section, 'another-fingerprint'))
+
+
+# 26/10/18: a single section is read straight from the zip,
+# instead of decompressing the whole book (images included).
+class TestingEpubZipReader(unittest.TestCase):
+    def test_section_path_variations_are_resolved_against_the_manifest(self):
+        reader = get_epub_reader(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        self.assertEqual(reader.find_section_href('OEBPS/4134408533708019941_1260-h-25.htm.html'),
+                         '4134408533708019941_1260-h-25.htm.html')
+        self.assertIsNone(reader.find_section_href('OEBPS/missing.html'))
+
+    def test_only_the_requested_section_is_decompressed(self):
+        reader = EpubZipReader(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        content = reader.read_section('OEBPS/4134408533708019941_1260-h-25.htm.html')
+        self.assertIn(b'he had not eyes behind', content)
+        self.assertEqual(list(reader._members), ['OEBPS/4134408533708019941_1260-h-25.htm.html'])
+        reader.close()
+
+
+# 26/10/18: expanding a highlight used to re-split the whole soup on every keypress.
+class TestingSentenceIndex(unittest.TestCase):
+    SOUP = "First one. Second one? Third, with •bullet! Fourth.\n\nFifth one"
+
+    def test_offsets_give_the_same_sentences_as_splitting(self):
+        index = SentenceIndex.from_text(self.SOUP)
+        self.assertEqual(index.as_list(), break_string_into_list_of_sentences(self.SOUP))
+
+    def test_offsets_survive_serialization(self):
+        index = SentenceIndex.from_text(self.SOUP)
+        restored = SentenceIndex.from_bytes(self.SOUP, index.to_bytes())
+        self.assertEqual(restored.as_list(), index.as_list())
+
+    def test_can_expand_from_indexed_sentences(self):
+        self.assertEqual(expand_found_highlight(['Third, with •bullet!'], self.SOUP, 2, True),
+                         ['First one.', 'Second one?'])
+        self.assertEqual(expand_found_highlight(['Third, with •bullet!'], self.SOUP, 5, False),
+                         ['Fourth.', 'Fifth one'])
+        # same as slicing a list: asking for too much backwards gives nothing
+        self.assertEqual(expand_found_highlight(['Second one?'], self.SOUP, 2, True), [])
+
+
+# 26/10/18: all highlights of a section are now located in one pass;
+# the results must be the same as the naive ('x' in 'xyz') search.
+class TestingHighlightLocator(unittest.TestCase):
+    SOUP = ("It was a dark night. The wind howled, and the rain fell. "
+            "She said: was it dark? Nobody answered. The rain fell again!")
+
+    def test_locates_the_first_sentence_containing_each_fragment(self):
+        index = SentenceIndex.from_text(self.SOUP)
+        fragments = ['dark', 'rain fell', 'answered', 'again!', 'not there', 'night. The']
+        expected = {}
+        for fragment in fragments:
+            try:
+                expected[fragment] = get_index_of_sentence_in_sentences_list(fragment, index.as_list())[0]
+            except StopIteration:
+                pass
+        self.assertEqual(locate_fragments(index, fragments), expected)
+        # many fragments go through the automaton instead of `str.find`
+        many = fragments + [f'missing {i}' for i in range(AUTOMATON_MIN_FRAGMENTS)]
+        self.assertEqual(locate_fragments(index, many), expected)
+
+    def test_can_resolve_many_highlights_of_a_section_at_once(self):
+        self.assertEqual(
+            get_start_and_end_of_highlights(self.SOUP, ['wind howled', 'dark? Nobody answered', 'snow']),
+            [['The wind howled, and the rain fell.'],
+             ['She said: was it dark?', 'Nobody answered.'],
+             None])
+
+
+# 26/10/18: Kobo's container paths already say where a highlight is;
+# text search is now only the fallback.
+class TestingPointPaths(unittest.TestCase):
+    SECTION = 'OEBPS/4134408533708019941_1260-h-25.htm.html'
+    HIGHLIGHT = 'no noise: he had'
+
+    def test_can_parse_a_container_path(self):
+        point = parse_point_path('text/part0011.html#point(/1/4/192/3:147)')
+        self.assertEqual((point.section, point.steps, point.offset),
+                         ('text/part0011.html', [1, 4, 192, 3], 147))
+        self.assertIsNone(parse_point_path('text/part0011.html'))
+
+    def test_can_resolve_container_paths_to_offsets_in_the_soup(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        soup = get_full_context_from_highlight(book_path, self.SECTION)
+        # the paragraph's text node starts with '\nI had made '
+        start, end = get_highlight_offsets_from_container_paths(
+                book_path, soup, self.HIGHLIGHT,
+                self.SECTION + '#point(/1/4/1/22/1:12)',
+                self.SECTION + '#point(/1/4/1/22/1:28)')
+        self.assertEqual(soup[start:end], self.HIGHLIGHT)
+
+    def test_container_paths_not_landing_on_the_highlight_are_ignored(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        soup = get_full_context_from_highlight(book_path, self.SECTION)
+        self.assertIsNone(get_highlight_offsets_from_container_paths(
+                book_path, soup, self.HIGHLIGHT,
+                self.SECTION + '#point(/1/4/1/20/1:12)',
+                self.SECTION + '#point(/1/4/1/20/1:28)'))
+
+
+# 26/10/18: where a highlight is (and its chapter) is only resolved once.
+class TestingHighlightLocationCache(unittest.TestCase):
+    SECTION = 'OEBPS/4134408533708019941_1260-h-25.htm.html'
+    HIGHLIGHT_ID = 'not-a-real-highlight-id'
+
+    def test_location_is_resolved_once(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        soup = get_full_context_from_highlight(book_path, self.SECTION)
+        container_paths = (self.SECTION + '#point(/1/4/1/22/1:12)',
+                           self.SECTION + '#point(/1/4/1/22/1:28)')
+        with mock.patch('utils.highlight_handling.get_highlight_container_paths_from_database',
+                        return_value=container_paths):
+            location = get_highlight_location_from_id(self.HIGHLIGHT_ID, 'no noise: he had',
+                                                      book_path, soup)
+        self.assertEqual(soup[location.start_offset:location.end_offset], 'no noise: he had')
+        with mock.patch('utils.highlight_handling.locate_highlight') as locate:
+            cached = get_highlight_location_from_id(self.HIGHLIGHT_ID, 'no noise: he had',
+                                                    book_path, soup)
+        locate.assert_not_called()
+        self.assertEqual(cached, location)
+
+    def test_chapter_is_resolved_once(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        chapter = get_chapter_of_highlight(self.HIGHLIGHT_ID + '-chapter', self.SECTION + '#point(/1/4/1/22/1:12)', book_path)
+        with mock.patch('utils.toc_handling.match_highlight_section_to_chapter') as match:
+            self.assertEqual(get_chapter_of_highlight(self.HIGHLIGHT_ID + '-chapter', self.SECTION, book_path),
+                             chapter)
+        match.assert_not_called()
+
+
+# 26/10/18: `python cli.py index` resolves a whole book section by section,
+# and a second run only looks at what is still unresolved.
+class TestingLibraryIndex(unittest.TestCase):
+    SECTION = 'OEBPS/4134408533708019941_1260-h-25.htm.html'
+
+    def setUp(self):
+        soup = get_full_context_from_highlight(
+                os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE), self.SECTION)
+        searched = SentenceIndex.from_text(soup).sentence(3)
+        highlights = [('index-by-point', 'no noise: he had', self.SECTION + '#point(/1/4/1/22/1:12)',
+                       self.SECTION + '#point(/1/4/1/22/1:28)'),
+                      ('index-by-search', searched, self.SECTION + '#point(/1/4/1/2/1:0)', None),
+                      ('index-miss', 'not in this book at all', self.SECTION + '#point(/1/4/1/2/1:0)', None)]
+        records = [database.HighlightRecord(highlight_id, 'Jane Eyre', 'Charlotte Brontë', text, '',
+                                            start_container_path, end_container_path,
+                                            'file:///mnt/onboard/' + TEST_EPUB_JANEEYRE)
+                   for highlight_id, text, start_container_path, end_container_path in highlights]
+        # (each test starts with nothing indexed)
+        cache_store.forget_highlight_locations([record.bookmark_id for record in records])
+        for name, value in (('utils.library_index.BOOKS_DIR', os.path.abspath(TEST_BOOKS_DIR) + '/'),
+                            ('utils.library_index.get_highlight_records_of_book', lambda _: records)):
+            patch = mock.patch(name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_book_is_indexed_once(self):
+        first = index_book(TEST_EPUB_JANEEYRE)
+        second = index_book(TEST_EPUB_JANEEYRE)
+        self.assertEqual((first.highlights, first.resolved, first.already_indexed), (3, 2, 0))
+        self.assertEqual([highlight_id for highlight_id, _ in first.failures], ['index-miss'])
+        self.assertEqual((second.resolved, second.already_indexed, len(second.failures)), (0, 2, 1))
+
+    def test_missing_epubs_are_reported(self):
+        [report] = index_library(['not-a-book.epub'])
+        self.assertEqual([filename for filename, _ in report.failures], ['not-a-book.epub'])
+
+    def test_forced_index_resolves_chapters_again(self):
+        index_book(TEST_EPUB_JANEEYRE)
+        fingerprint = get_epub_fingerprint(os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE))
+        chapter = cache_store.get_highlight_location('index-by-point', fingerprint).chapter
+        cache_store.put_highlight_chapter('index-by-point', fingerprint, 'a stale chapter')
+        self.assertEqual(index_book(TEST_EPUB_JANEEYRE, force=True).resolved, 2)
+        self.assertEqual(cache_store.get_highlight_location('index-by-point', fingerprint).chapter,
+                         chapter)
+
+
+# 26/10/18: the ids record is read once, and again only when it changes on disk.
+class TestingHighlightIdRegistry(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ids.tid')
+        with open(self.path, 'w') as file:
+            file.write('title: kobo highlight ids of quotes\n\nfirst-id\n\n')
+
+    def test_record_is_read_once(self):
+        registry = HighlightIdRegistry(self.path)
+        self.assertIn('first-id', registry)
+        with mock.patch('builtins.open') as opened:
+            self.assertNotIn('second-id', registry)
+        opened.assert_not_called()
+
+    def test_own_and_external_additions_are_seen(self):
+        registry = HighlightIdRegistry(self.path)
+        registry.add('second-id')
+        self.assertIn('second-id', registry)
+        with open(self.path, 'a') as file:
+            file.write('\n\nthird-id\n\n')
+        self.assertIn('third-id', registry)
+
+
+# 26/10/18: the tiddlers folder is scanned once, and again only when
+# something other than kobogarden changes it.
+class TestingTiddlerDirectoryIndex(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        with open(os.path.join(self.path, 'first.tid'), 'w') as file:
+            file.write('title: first\n')
+
+    def test_folder_is_scanned_once(self):
+        index = TiddlerDirectoryIndex(self.path)
+        self.assertIn('first', index)
+        with mock.patch('os.scandir', wraps=os.scandir) as scanned:
+            self.assertNotIn('second', index)
+            index.write('second', 'title: second\n')
+            self.assertIn('second', index)
+        scanned.assert_not_called()
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'second.tid')))
+
+    def test_external_changes_are_seen(self):
+        index = TiddlerDirectoryIndex(self.path)
+        self.assertNotIn('third', index)
+        with open(os.path.join(self.path, 'third.tid'), 'w') as file:
+            file.write('title: third\n')
+        # in case the filesystem's mtime is too coarse to tell
+        os.utime(self.path, ns=(0, 0))
+        self.assertIn('third', index)
+
+
+# 26/10/18: the metadata mappings are read once, and again only when
+# the file changes; writing them never leaves the file half written.
+class TestingMetadataMappingStore(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'mappings.txt')
+        with open(self.path, 'w') as file:
+            file.write('Bronte, Charlotte - Jane Eyre.epub|Jane Eyre|Charlotte Brontë\n')
+
+    def test_mappings_are_read_once(self):
+        store = MetadataMappingStore(self.path)
+        self.assertEqual(store.get('bronte charlotte - jane eyre.epub'), ('Jane Eyre', 'Charlotte Brontë'))
+        with mock.patch('builtins.open') as opened:
+            self.assertEqual(store.get('other.epub'), (None, None))
+        opened.assert_not_called()
+
+    def test_mappings_are_written_and_reloaded(self):
+        store = MetadataMappingStore(self.path)
+        store.set('other.epub', 'Other', 'Someone')
+        store.set('Bronte, Charlotte - Jane Eyre.epub', 'Jane Eyre', 'C. Brontë')
+        with open(self.path) as file:
+            self.assertEqual(file.read(), 'other.epub|Other|Someone\n'
+                             'Bronte, Charlotte - Jane Eyre.epub|Jane Eyre|C. Brontë\n')
+        with open(self.path, 'a') as file:
+            file.write('third.epub|Third|Nobody\n')
+        self.assertEqual(store.get('third.epub'), ('Third', 'Nobody'))
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['mappings.txt'])
+
+
+# 26/10/18: the Kobo database is opened read-only, once, and reopened
+# only when the file is replaced by a new copy.
+class TestingKoboConnectionPool(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'kobo.sqlite')
+        self.make_database(self.path, 'first-id')
+        self.pool = KoboConnectionPool(self.path)
+        self.addCleanup(self.pool.close)
+
+    def make_database(self, path, highlight_id):
+        conn = sqlite3.connect(path)
+        with conn:
+            conn.execute('CREATE TABLE Bookmark (BookmarkID TEXT)')
+            conn.execute('INSERT INTO Bookmark VALUES (?)', (highlight_id,))
+        conn.close()
+
+    def test_connection_is_reused_and_read_only(self):
+        with self.pool.connection() as first:
+            with self.assertRaises(sqlite3.OperationalError):
+                first.execute('DELETE FROM Bookmark')
+        with self.pool.connection() as second:
+            self.assertIs(first, second)
+
+    def test_replaced_database_is_reopened(self):
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('SELECT BookmarkID FROM Bookmark').fetchone()[0], 'first-id')
+        self.make_database(self.path + '.new', 'second-id')
+        os.replace(self.path + '.new', self.path)
+        with self.pool.connection() as conn:
+            self.assertEqual(conn.execute('SELECT BookmarkID FROM Bookmark').fetchone()[0], 'second-id')
+
+
+# 26/10/18: connections to kobogarden's own databases outlive the threads
+# that use them, and the schema is only checked by the first one.
+class TestingSQLiteConnectionPool(unittest.TestCase):
+    def test_connections_are_reused_across_threads(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        setup = mock.Mock()
+        pool = SQLiteConnectionPool(directory.name + '/pool.sqlite', setup)
+        self.addCleanup(pool.close)
+        used = []
+        for _ in range(3):
+            def use():
+                with pool.connection() as conn:
+                    used.append(conn)
+            thread = threading.Thread(target=use)
+            thread.start()
+            thread.join()
+        setup.assert_called_once()
+        self.assertEqual(len(set(map(id, used))), 1)
+
+
+# 26/10/18: queries go to an indexed mirror of the Kobo database,
+# which is rebuilt when the Kobo database changes.
+class TestingKoboMirror(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'kobo.sqlite')
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute('CREATE TABLE content (ContentID TEXT, ContentType INTEGER, '
+                         'Title TEXT, Attribution TEXT, BookId TEXT)')
+            conn.execute('CREATE TABLE Bookmark (BookmarkID TEXT, VolumeID TEXT, Text TEXT, '
+                         'DateCreated TEXT, DateModified TEXT, '
+                         'StartContainerPath TEXT, EndContainerPath TEXT)')
+            conn.execute("INSERT INTO content VALUES ('file:///mnt/onboard/jane-eyre.epub', 6, "
+                         "'Jane Eyre', 'Charlotte Brontë', NULL)")
+            conn.executemany('INSERT INTO Bookmark VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                ('second', 'file:///mnt/onboard/jane-eyre.epub', ' Reader, I married him.',
+                 '2023-08-31T10:00:00.000', None, 'a.html#point(/1/2:0)', 'a.html#point(/1/2:22)'),
+                ('first', 'file:///mnt/onboard/jane-eyre.epub', 'I had made no noise',
+                 '2023-08-30T10:00:00.000', None, 'b.html#point(/1/4:0)', 'b.html#point(/1/4:19)')])
+        conn.close()
+        self.addCleanup(close_connection_pools)
+        database._highlight_records.clear()
+        self.addCleanup(database._highlight_records.clear)
+        for name, value in (('utils.database.SQLITE_DB_PATH', directory.name + '/'),
+                            ('utils.database.SQLITE_DB_NAME', 'kobo.sqlite'),
+                            ('utils.kobo_mirror.KOBO_MIRROR_DB_PATH', directory.name + '/mirror.sqlite')):
+            patch = mock.patch(name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_books_and_highlights_come_from_the_mirror(self):
+        self.assertEqual(get_list_of_highlighted_books(self.path),
+                         [['Jane Eyre', 'Charlotte Brontë', 'jane-eyre.epub']])
+        self.assertEqual([row[2] for row in get_all_highlights_of_book_from_database('jane-eyre.epub')],
+                         ['first', 'second'])
+        second = get_highlight_records_of_book('jane-eyre.epub')[1]
+        self.assertEqual((second.start_container_path, second.end_container_path),
+                         ('a.html#point(/1/2:0)', 'a.html#point(/1/2:22)'))
+
+    def test_mirror_follows_changes_to_the_kobo_database(self):
+        self.assertEqual(len(get_all_highlights_of_book_from_database('jane-eyre.epub')), 2)
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("DELETE FROM Bookmark WHERE BookmarkID = 'first'")
+        conn.close()
+        self.assertEqual(len(get_all_highlights_of_book_from_database('jane-eyre.epub')), 1)
+
+    def test_sync_only_reports_what_changed_on_the_device(self):
+        get_list_of_highlighted_books(self.path)
+        cache_store.put_highlight_location(cache_store.HighlightLocation('second', 'fingerprint', 'a.html', 0, 22, 0, 0))
+        cache_store.put_highlight_location(cache_store.HighlightLocation('first', 'fingerprint', 'b.html', 0, 19, 0, 0))
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("UPDATE Bookmark SET Text = 'Reader, I married him', "
+                         "DateModified = '2023-09-01T10:00:00.000' WHERE BookmarkID = 'second'")
+            conn.execute("DELETE FROM Bookmark WHERE BookmarkID = 'first'")
+        conn.close()
+        changes = sync_kobo_mirror(self.path)
+        self.assertEqual((changes.changed, changes.deleted), (['second'], ['first']))
+        self.assertIsNone(cache_store.get_highlight_location('second', 'fingerprint'))
+        with kobo_mirror.borrow_mirror_connection() as conn:
+            self.assertEqual(conn.execute('SELECT bookmark_id FROM deleted_highlights').fetchall(),
+                             [('first',)])
+        self.assertFalse(sync_kobo_mirror(self.path))
+
+    def test_only_a_copy_newer_than_the_last_sync_replaces_the_device(self):
+        # the copy at SQLITE_DB_PATH is taken, then the device is synced,
+        # a highlight deleted on it and synced again, and it's unmounted
+        device_path = os.path.join(os.path.dirname(self.path), 'device.sqlite')
+        shutil.copy(self.path, device_path)
+        os.utime(self.path, (time.time() - 60, time.time() - 60))
+        sync_kobo_mirror(device_path)
+        conn = sqlite3.connect(device_path)
+        with conn:
+            conn.execute("DELETE FROM Bookmark WHERE BookmarkID = 'first'")
+        conn.close()
+        sync_kobo_mirror(device_path)
+        os.remove(device_path)
+        self.assertEqual(len(get_all_highlights_of_book_from_database('jane-eyre.epub')), 1)
+        # a copy taken since is synced from
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute("DELETE FROM Bookmark WHERE BookmarkID = 'first'")
+            conn.execute("INSERT INTO Bookmark VALUES ('third', 'file:///mnt/onboard/jane-eyre.epub', "
+                         "'Mr. Rochester', '2023-09-01T10:00:00.000', NULL, "
+                         "'c.html#point(/1/2:0)', 'c.html#point(/1/2:13)')")
+        conn.close()
+        os.utime(self.path, (time.time() + 60, time.time() + 60))
+        self.assertEqual(len(get_all_highlights_of_book_from_database('jane-eyre.epub')), 2)
+
+    def test_opening_a_listed_highlight_makes_no_query(self):
+        get_all_highlights_of_book_from_database('jane-eyre.epub')
+        with mock.patch('utils.database.mirror_connection', side_effect=AssertionError):
+            title, _, highlight, _, section, filename = get_highlight_from_database('second')
+            paths = get_highlight_container_paths_from_database('second')
+        self.assertEqual((title, highlight, filename), ('Jane Eyre', 'Reader, I married him.', 'jane-eyre.epub'))
+        self.assertEqual(paths, (section, 'a.html#point(/1/2:22)'))
+
+    def test_highlights_are_paged_by_key(self):
+        get_list_of_highlighted_books(self.path)
+        [first] = get_page_of_highlight_records('jane-eyre.epub', limit=1)
+        [second] = get_page_of_highlight_records('jane-eyre.epub',
+                                                 (first.date_created, first.bookmark_id), limit=1)
+        self.assertEqual((first.bookmark_id, second.bookmark_id), ('first', 'second'))
+        self.assertEqual(get_page_of_highlight_records(
+            'jane-eyre.epub', (second.date_created, second.bookmark_id)), [])
+        [book] = get_page_of_highlighted_books(limit=1)
+        self.assertEqual(get_page_of_highlighted_books((book[3], book[4])), [])
+
+    def test_book_lookups_use_indexes(self):
+        get_list_of_highlighted_books(self.path)
+        with kobo_mirror.borrow_mirror_connection() as conn:
+            plan = ' '.join(row[-1] for row in conn.execute("""
+                EXPLAIN QUERY PLAN
+                SELECT highlights.text, highlights.date_created, highlights.bookmark_id,
+                       highlights.start_container_path
+                FROM books JOIN highlights ON highlights.volume_id = books.volume_id
+                WHERE books.filename = ? ORDER BY highlights.date_created
+            """, ('jane-eyre.epub',)))
+        self.assertNotIn('SCAN', plan)
+
+
+# 26/10/18: a book whose epub isn't in BOOKS_DIR still lists its highlights
+# (without chapters), instead of failing the worker that loads them.
+class TestingBookHighlightsScreen(unittest.TestCase):
+    def test_highlights_of_a_missing_epub_are_listed(self):
+        from interface.book_highlights_screen import BookHighlightsScreen
+        record = database.HighlightRecord(
+                'missing-epub', 'Book', 'Author', 'Reader, I married him.',
+                '2023-08-31T10:00:00.000', 'a.html#point(/1/2:0)', 'a.html#point(/1/2:22)',
+                'file:///mnt/onboard/book.epub')
+        with mock.patch('interface.book_highlights_screen.get_page_of_highlight_records',
+                        return_value=[record]), \
+             mock.patch('interface.book_highlights_screen.BOOKS_DIR', '/nonexistent/'):
+            screen = BookHighlightsScreen('highlights', None, {'title': 'Book', 'author': 'Author',
+                                                               'filename': 'book.epub'})
+            options, next_key = screen.fetch_highlights_page(None)
+        self.assertEqual([option.id for option in options], ['missing-epub'])
+        self.assertIsNone(next_key)
+
+
+# 26/10/18: chapters are found through the spine (reading order),
+# at any depth of the TOC.
+class TestingChapterIndex(unittest.TestCase):
+    SPINE = ['text/cover.html', 'text/zz_intro.html', 'text/aa_one.html',
+             'text/mm_one_notes.html', 'text/bb_two.html']
+    TOC = [epub.Link('text/zz_intro.html', 'Introduction', 'intro'),
+           (epub.Section('Part One'), [
+               (epub.Section('Chapters'), [
+                   epub.Link('text/aa_one.html', 'One', 'one'),
+                   epub.Link('text/bb_two.html#start', 'Two', 'two')])])]
+
+    def test_nested_toc_entries_are_found(self):
+        index = ChapterIndex(self.TOC, self.SPINE)
+        self.assertEqual(index.chapter_of('OEBPS/text/bb_two.html#point(/1/4/2:0)'), 'Two')
+
+    def test_sections_out_of_the_toc_belong_to_the_chapter_before_them_in_reading_order(self):
+        index = ChapterIndex(self.TOC, self.SPINE)
+        # sorting file names would give 'Two'
+        self.assertEqual(index.chapter_of('OEBPS/text/mm_one_notes.html#point(/1/4/2:0)'), 'One')
+        self.assertIsNone(index.chapter_of('text/cover.html'))
+
+    def test_book_index_is_built_once(self):
+        book_path = os.path.abspath(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE)
+        index = get_chapter_index(book_path)
+        self.assertIs(get_chapter_index(book_path), index)
+        self.assertIsNotNone(index.chapter_of('OEBPS/4134408533708019941_1260-h-25.htm.html'))
+
+
+# 26/10/18: highlights not yet exported are turned into tiddlers in bulk,
+# with the book tiddler and the ids record written once per book.
+class TestingTiddlerExport(unittest.TestCase):
+    def setUp(self):
+        TestingKoboMirror.setUp(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.tiddlers = directory.name + '/'
+        with open(self.tiddlers + 'ids.tid', 'w') as file:
+            file.write('title: kobo highlight ids of quotes\n\n')
+        self.registry = HighlightIdRegistry(self.tiddlers + 'ids.tid')
+        for name, value in (
+                ('utils.tiddler_state.TIDDLER_STATE_DB_PATH', self.tiddlers + 'state.sqlite'),
+                ('utils.tiddler_export.TIDDLERS_PATH', self.tiddlers),
+                ('utils.tiddler_handling.TIDDLERS_PATH', self.tiddlers),
+                ('utils.tiddler_export.BOOKS_DIR', TEST_BOOKS_DIR),
+                ('utils.tiddler_handling.PAOGARDEN_DIR', self.tiddlers),
+                ('utils.tiddler_handling.extract_cover_in_background', lambda *_: None),
+                ('utils.tiddler_handling.tiddler_directory_index', TiddlerDirectoryIndex(self.tiddlers)),
+                ('utils.tiddler_handling.highlight_id_registry', self.registry)):
+            patch = mock.patch(name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def read(self, title: str) -> str:
+        with open(self.tiddlers + title + '.tid') as file:
+            return file.read()
+
+    def test_book_is_exported_once(self):
+        with mock.patch.object(HighlightIdRegistry, 'add_many', wraps=self.registry.add_many) as added:
+            report = tiddler_export.export_book(TEST_EPUB_JANEEYRE, tags=['novel'])
+        added.assert_called_once()
+        self.assertEqual(report.exported, ['I had made no noise', 'Reader, I married him'])
+        self.assertIn('nbr_of_highlights: 2', self.read('Jane Eyre'))
+        self.assertIn('tags: book-quote novel', self.read('I had made no noise'))
+        self.assertIn('quote-order: 02', self.read('Reader, I married him'))
+        self.assertTrue(os.path.exists(self.tiddlers + 'fhl-Jane Eyre.tid'))
+        self.assertIn('second', self.registry)
+
+        again = tiddler_export.export_book(TEST_EPUB_JANEEYRE)
+        self.assertEqual((again.exported, again.already_exported), ([], 2))
+
+    def test_book_tiddler_is_updated_in_batch(self):
+        with open(self.tiddlers + 'Jane Eyre.tid', 'w') as file:
+            file.write('title: Jane Eyre\nnbr_of_highlights: 4\n')
+        self.assertEqual(tiddler_handling.take_quote_order('Jane Eyre'), 5)
+        self.assertIn('nbr_of_highlights: 4', self.read('Jane Eyre'))
+        self.assertEqual(tiddler_handling.update_book_tiddlers(), ['Jane Eyre'])
+        self.assertIn('nbr_of_highlights: 5', self.read('Jane Eyre'))
+        self.assertEqual(tiddler_handling.update_book_tiddlers(), [])
+
+        report = tiddler_export.export_book(TEST_EPUB_JANEEYRE)
+        self.assertIn('quote-order: 07', self.read(report.exported[-1]))
+        self.assertIn('nbr_of_highlights: 7', self.read('Jane Eyre'))
+
+    def test_quote_orders_are_taken_once(self):
+        orders = []
+        def take():
+            for _ in range(20):
+                orders.extend(tiddler_state.take_quote_orders('Jane Eyre', 2, lambda: 0))
+        threads = [threading.Thread(target=take) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(orders), list(range(1, 161)))
+
+    def test_book_is_exported_to_a_bundle(self):
+        bundle = self.tiddlers + 'bundle/quotes.json'
+        with JsonBundleSink(bundle) as sink:
+            reports = list(tiddler_export.export_library([TEST_EPUB_JANEEYRE], tags=['novel'],
+                                                         sink=sink.write))
+        with open(bundle) as file:
+            tiddlers = {tiddler['title']: tiddler for tiddler in json.load(file)}
+        self.assertEqual(set(tiddlers), {'Jane Eyre', 'fhl-Jane Eyre', *reports[0].exported})
+        quote = tiddlers['Reader, I married him']
+        self.assertEqual((quote['tags'], quote['quote-order']), ('book-quote novel', '02'))
+        self.assertEqual(quote['text'], '<<<\nReader, I married him.\n<<<\n')
+        self.assertEqual(tiddlers['Jane Eyre']['nbr_of_highlights'], '2')
+        self.assertFalse(os.path.exists(self.tiddlers + 'Reader, I married him.tid'))
+        self.assertIn('second', self.registry)
+
+    def test_titles_are_not_reused(self):
+        taken = set()
+        self.assertEqual(tiddler_export.auto_title('One [two] three.', taken), 'One two three')
+        self.assertEqual(tiddler_export.auto_title('One two three!', taken), 'One two three (2)')
+
+
+# 26/10/18: covers are streamed out of the epub, and only once.
+class TestingCoverExtraction(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.images = directory.name + '/'
+        patch = mock.patch('utils.retrieve_cover_from_epub.IMAGE_FILES_PATH', self.images)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_cover_is_extracted_once(self):
+        epub_path = TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE
+        filename = extract_cover_from_epub(epub_path, 'Jane Eyre')
+        self.assertEqual(filename, 'book-cover-jane-eyre.png')
+        with open(self.images + filename, 'rb') as file:
+            self.assertEqual(file.read(8), b'\x89PNG\r\n\x1a\n')
+        with mock.patch('shutil.copyfileobj') as copied:
+            self.assertEqual(extract_cover_from_epub(epub_path, 'Jane Eyre'), filename)
+        copied.assert_not_called()
+
+    def test_covers_are_extracted_in_bulk(self):
+        books = [(TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE, 'Jane Eyre'),
+                 (TEST_BOOKS_DIR + TEST_EPUB_JANEEYRE, 'Jane Eyre again')]
+        self.assertEqual(sorted(extract_covers(books, workers=2)),
+                         [('Jane Eyre', 'book-cover-jane-eyre.png'),
+                          ('Jane Eyre again', 'book-cover-jane-eyre-again.png')])
+
+
+# 26/10/18: logs are written by a background thread, and messages
+# below the level are never formatted.
+class TestingLogging(unittest.TestCase):
+    def test_disabled_logs_are_not_formatted(self):
+        import logging
+        import logging.handlers
+        class Expensive:
+            def __str__(self):
+                raise AssertionError("formatted")
+        root = logging.getLogger()
+        self.assertTrue(any(isinstance(handler, logging.handlers.QueueHandler)
+                            for handler in root.handlers))
+        level = root.level
+        root.setLevel(logging.INFO)
+        self.addCleanup(root.setLevel, level)
+        logging.debug("metadata: %s", Expensive())
+
+    def test_unknown_level_falls_back_to_the_default(self):
+        result = subprocess.run([sys.executable, '-c', """
+from utils.const import LOG_LEVEL
+from utils.logging import logging
+assert logging.getLogger().level == logging.getLevelNamesMapping()[LOG_LEVEL]
+"""], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env={**os.environ, 'KOBOGARDEN_LOG_LEVEL': 'verbose'},
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+
+# 26/10/18: what the cursor rests on is resolved in the background;
+# moving on drops what is still waiting.
+class TestingPrefetcher(unittest.TestCase):
+    def test_queue_is_bounded_and_can_be_cancelled(self):
+        started, release, done = threading.Event(), threading.Event(), []
+        prefetcher = Prefetcher(max_queued=2)
+        prefetcher.submit('blocking', lambda: (started.set(), release.wait(5)))
+        self.assertTrue(started.wait(5))
+        for key in ('first', 'second', 'third', 'third'):
+            prefetcher.submit(key, done.append, key)
+        self.assertEqual(prefetcher.pending(), ['second', 'third'])
+        prefetcher.cancel()
+        prefetcher.submit('fourth', done.append, 'fourth')
+        finished = threading.Event()
+        prefetcher.submit('last', finished.set)
+        release.set()
+        self.assertTrue(finished.wait(5))
+        self.assertEqual(done, ['fourth'])
+
+
+# 26/10/18: the main screen is shown before the epub parsers
+# (and everything else only the other screens need) are imported.
+class TestingStartup(unittest.TestCase):
+    def run_python(self, code: str) -> str:
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout
+
+    def test_main_screen_does_not_import_heavy_modules(self):
+        imported = self.run_python("""
+import sys
+import interface.main_screen
+print(' '.join(module for module in ('bs4', 'ebooklib', 'lxml', 'pyperclip')
+               if module in sys.modules))
+""")
+        self.assertEqual(imported.strip(), '')
 
+    def test_nothing_is_printed_at_import(self):
+        self.assertEqual(self.run_python("import utils.tiddler_handling"), '')
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,256 @@
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from utils.const import CACHE_DB_PATH
+from utils.logging import logging
+from utils.sqlite_pool import get_connection_pool
+
+# kobogarden's own cache database; everything in here can be
+# recomputed from the epubs, so it's safe to delete the file
+# (and it is rebuilt from scratch whenever SCHEMA_VERSION changes).
+SCHEMA_VERSION = 3
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS section_text (
+    book_path TEXT NOT NULL,
+    section_path TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    text BLOB NOT NULL,
+    sentence_offsets BLOB NOT NULL,
+    PRIMARY KEY (book_path, section_path)
+) WITHOUT ROWID;
+
+-- where a highlight was found in its book; `chapter` is NULL until
+-- resolved, and '' when the highlight has no chapter
+CREATE TABLE IF NOT EXISTS highlight_location (
+    bookmark_id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    section_path TEXT,
+    start_offset INTEGER,
+    end_offset INTEGER,
+    start_sentence INTEGER,
+    end_sentence INTEGER,
+    chapter TEXT
+) WITHOUT ROWID;
+"""
+
+
+@dataclass
+class HighlightLocation:
+    """Where a highlight lives in (a given version of) its epub;
+    offsets are into the section text, sentence indices are inclusive"""
+    bookmark_id: str
+    fingerprint: str
+    section_path: Optional[str] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+    start_sentence: Optional[int] = None
+    end_sentence: Optional[int] = None
+    chapter: Optional[str] = None
+
+    @property
+    def is_located(self) -> bool:
+        return self.start_sentence is not None
+
+
+def _set_up_cache(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+        _reset_schema(conn)
+    conn.executescript(SCHEMA)
+
+
+@contextmanager
+def borrow_cache_connection() -> Iterator[Optional[sqlite3.Connection]]:
+    """`with borrow_cache_connection() as conn:` borrows a connection to the
+    cache database from its pool (see `utils/sqlite_pool.py`); `conn` is None
+    if the cache can't be opened, and callers should then just skip caching."""
+    pool = get_connection_pool(CACHE_DB_PATH, _set_up_cache,
+                               pragmas=("synchronous=NORMAL",), timeout=10)
+    try:
+        conn = pool.acquire()
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("Cache database unavailable at %s: %s", CACHE_DB_PATH, e)
+        yield None
+        return
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+def _reset_schema(conn: sqlite3.Connection) -> None:
+    tables = [name for (name,) in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'")]
+    with conn:
+        for table in tables:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def get_section(
+        book_path: str,
+        section_path: str,
+        fingerprint: str
+        ) -> Optional[tuple[str, bytes]]:
+    """Returns the stored plain text of a section and its sentence offsets
+    (see `SentenceIndex.to_bytes`), or None if it was never stored
+    or the epub has changed since."""
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("""
+                SELECT text, sentence_offsets FROM section_text
+                WHERE book_path = ? AND section_path = ? AND fingerprint = ?
+            """, (book_path, section_path, fingerprint)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning("Could not read section text from cache: %s", e)
+            return None
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode('utf-8'), zlib.decompress(row[1])
+
+
+def get_section_text(
+        book_path: str,
+        section_path: str,
+        fingerprint: str
+        ) -> Optional[str]:
+    """Returns the stored plain text of a section,
+    or None if it was never stored or the epub has changed since."""
+    section = get_section(book_path, section_path, fingerprint)
+    return section[0] if section else None
+
+
+def put_section_text(
+        book_path: str,
+        section_path: str,
+        fingerprint: str,
+        text: str,
+        sentence_offsets: bytes
+        ) -> None:
+    """Stores the plain text of a section and its sentence offsets;
+    sections stored for an older version of the same epub are dropped."""
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute("""
+                    DELETE FROM section_text
+                    WHERE book_path = ? AND fingerprint != ?
+                """, (book_path, fingerprint))
+                conn.execute("""
+                    INSERT OR REPLACE INTO section_text
+                    (book_path, section_path, fingerprint, text, sentence_offsets)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (book_path, section_path, fingerprint,
+                      zlib.compress(text.encode('utf-8')),
+                      zlib.compress(sentence_offsets)))
+        except sqlite3.Error as e:
+            logging.warning("Could not write section text to cache: %s", e)
+
+
+def get_highlight_location(
+        bookmark_id: str,
+        fingerprint: str
+        ) -> Optional[HighlightLocation]:
+    """Returns what is known about where a highlight is,
+    or None if nothing is (for this version of the epub)."""
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return None
+        try:
+            row = conn.execute("""
+                SELECT bookmark_id, fingerprint, section_path, start_offset,
+                       end_offset, start_sentence, end_sentence, chapter
+                FROM highlight_location
+                WHERE bookmark_id = ? AND fingerprint = ?
+            """, (bookmark_id, fingerprint)).fetchone()
+        except sqlite3.Error as e:
+            logging.warning("Could not read highlight location from cache: %s", e)
+            return None
+        return HighlightLocation(*row) if row else None
+
+
+def put_highlight_location(location: HighlightLocation, force: bool = False) -> None:
+    """Stores where a highlight is; a chapter already known for the
+    same version of the epub is kept (unless `force`, which replaces it
+    with the location's, so it is resolved again if that is None)."""
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO highlight_location
+                    (bookmark_id, fingerprint, section_path, start_offset,
+                     end_offset, start_sentence, end_sentence, chapter)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (bookmark_id) DO UPDATE SET
+                        section_path = excluded.section_path,
+                        start_offset = excluded.start_offset,
+                        end_offset = excluded.end_offset,
+                        start_sentence = excluded.start_sentence,
+                        end_sentence = excluded.end_sentence,
+                        chapter = CASE WHEN fingerprint = excluded.fingerprint AND NOT ?
+                                  THEN coalesce(excluded.chapter, chapter)
+                                  ELSE excluded.chapter END,
+                        fingerprint = excluded.fingerprint
+                """, (location.bookmark_id, location.fingerprint, location.section_path,
+                      location.start_offset, location.end_offset,
+                      location.start_sentence, location.end_sentence, location.chapter, force))
+        except sqlite3.Error as e:
+            logging.warning("Could not write highlight location to cache: %s", e)
+
+
+def put_highlight_chapter(
+        bookmark_id: str,
+        fingerprint: str,
+        chapter: Optional[str]
+        ) -> None:
+    """Stores the chapter of a highlight (None meaning it has none);
+    a location already known for the same version of the epub is kept."""
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.execute("""
+                    INSERT INTO highlight_location (bookmark_id, fingerprint, chapter)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (bookmark_id) DO UPDATE SET
+                        section_path = CASE WHEN fingerprint = excluded.fingerprint
+                                       THEN section_path END,
+                        start_offset = CASE WHEN fingerprint = excluded.fingerprint
+                                       THEN start_offset END,
+                        end_offset = CASE WHEN fingerprint = excluded.fingerprint
+                                     THEN end_offset END,
+                        start_sentence = CASE WHEN fingerprint = excluded.fingerprint
+                                         THEN start_sentence END,
+                        end_sentence = CASE WHEN fingerprint = excluded.fingerprint
+                                       THEN end_sentence END,
+                        chapter = excluded.chapter,
+                        fingerprint = excluded.fingerprint
+                """, (bookmark_id, fingerprint, chapter if chapter is not None else ''))
+        except sqlite3.Error as e:
+            logging.warning("Could not write highlight chapter to cache: %s", e)
+
+
+def forget_highlight_locations(bookmark_ids: list[str]) -> None:
+    """Drops what is known about these highlights
+    (eg. they were edited or deleted on the device)"""
+    # most syncs have nothing to forget; the cache isn't even opened then
+    if not bookmark_ids:
+        return
+    with borrow_cache_connection() as conn:
+        if conn is None:
+            return
+        try:
+            with conn:
+                conn.executemany("DELETE FROM highlight_location WHERE bookmark_id = ?",
+                                 ((bookmark_id,) for bookmark_id in bookmark_ids))
+        except sqlite3.Error as e:
+            logging.warning("Could not forget highlight locations in cache: %s", e)
@@ -5,15 +5,58 @@ BOOKS_DIR = BASE_DIR + "books/"
 PAOGARDEN_DIR = BASE_DIR + "paogarden/"
 TIDDLERS_PATH = PAOGARDEN_DIR + "tiddlers/"
 IMAGE_FILES_PATH = PAOGARDEN_DIR + "files/"
+# quote counters of each book (see `utils/tiddler_state.py`)
+TIDDLER_STATE_DB_PATH = PAOGARDEN_DIR + "kobogarden_state.sqlite"
 PROJECT_DIR = BASE_DIR + "kobo_highlights/"
 SQLITE_DB_PATH = PROJECT_DIR
 SQLITE_DB_NAME = "my_kobo_db.sqlite"
 EXISTING_IDS_FILE = "kobo highlight ids of quotes.tid"
 DATABASE_PATH = SQLITE_DB_PATH + SQLITE_DB_NAME
+# where the Kobo database is when the device is mounted
+KOBO_DEVICE_DB_PATH = "/media/apinto/KOBOeReader/.kobo/KoboReader.sqlite"
+CACHE_DIR = PROJECT_DIR + "cache/"
+CACHE_DB_PATH = CACHE_DIR + "kobogarden_cache.sqlite"
+KOBO_MIRROR_DB_PATH = CACHE_DIR + "kobo_mirror.sqlite"
 
 CSS_PATH = PROJECT_DIR + "css/"
 OPTIONS_CSS_PATH = CSS_PATH + "option_list.tcss"
 
+# parsed epubs are kept in memory up to this budget (see `utils/epub_cache.py`)
+EPUB_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# single sections are read straight from the zip (see `utils/epub_reader.py`)
+EPUB_READERS_MAX = 8
+EPUB_READER_HANDLES = 2
+EPUB_READER_MEMBERS_MAX_BYTES = 8 * 1024 * 1024
+# the Kobo database is opened read-only, once per thread that needs it
+# (see `utils/database.py`); a copy that is never written to while
+# kobogarden runs can be opened as immutable, which skips all locking
+KOBO_DB_IMMUTABLE = False
+KOBO_DB_CONNECTIONS_MAX = 4
+KOBO_DB_CACHED_STATEMENTS = 64
+# connections to kobogarden's own databases (cache, mirror, state)
+# kept open for the next thread that needs one (see `utils/sqlite_pool.py`)
+LOCAL_DB_CONNECTIONS_MAX = 4
+
+# the books and highlights lists are fetched and rendered a page at a time;
+# the next page is fetched when the cursor gets this close to the end
+LIST_PAGE_SIZE = 100
+LIST_PREFETCH_MARGIN = 20
+# what the cursor rests on is resolved ahead of time (see `utils/prefetch.py`);
+# only the most recent requests are kept
+PREFETCH_QUEUE_MAX = 8
+# highlights exported in bulk (see `python cli.py export`) are titled
+# after their first words
+AUTO_TITLE_WORDS = 8
+# logs go to a rotating file, written by a background thread (see
+# `utils/logging.py`); the level can be overridden with KOBOGARDEN_LOG_LEVEL
+LOG_FILE = "app.log"
+LOG_LEVEL = "DEBUG"
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+# how long (median of a few cold starts, in seconds) the main screen may take
+# to show its first frame; see `python cli.py startup`
+STARTUP_BUDGET_SECONDS = 1.0
+
 
 # Menu VIM bindings
 VIM_BINDINGS = [
@@ -1,5 +1,10 @@
+import os
 import sqlite3
-from typing import Optional
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from queue import Empty, LifoQueue
+from typing import Iterator, Optional
 import logging
 from pathlib import Path
 from utils.logging import logging
@@ -7,8 +12,20 @@ from utils.const import (
     SQLITE_DB_PATH,
     SQLITE_DB_NAME,
     BOOKS_DIR,
+    KOBO_DB_IMMUTABLE,
+    KOBO_DB_CONNECTIONS_MAX,
+    KOBO_DB_CACHED_STATEMENTS,
+    LIST_PAGE_SIZE,
     )
-from utils.epub_validation import validate_epub_structure
+from utils.kobo_mirror import (
+    MirrorChanges,
+    borrow_mirror_connection,
+    get_mirrored_source,
+    get_source_stamp,
+    is_newer_than_last_sync,
+    sync_mirror,
+)
+from utils.cache_store import forget_highlight_locations
 
 
 class DatabaseError(Exception):
@@ -26,6 +43,220 @@ def create_connection_to_database(path: str) -> sqlite3.Connection:
     return conn
 
 
+class KoboConnectionPool:
+    """Read-only connections to a Kobo database, kept open between queries
+    and handed out to one thread at a time. Queries are always parameterized,
+    so each connection's statement cache saves preparing them again.
+    If the database file is replaced (eg. by a new copy from the device),
+    the connections to the old one are closed on next use."""
+
+    def __init__(self, path: str, immutable: bool = KOBO_DB_IMMUTABLE,
+                 max_idle: int = KOBO_DB_CONNECTIONS_MAX):
+        self.path = path
+        self.immutable = immutable
+        self.max_idle = max_idle
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = Path(self.path).absolute().as_uri() + '?mode=ro'
+        if self.immutable:
+            uri += '&immutable=1'
+        return sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=KOBO_DB_CACHED_STATEMENTS)
+
+    def _revalidate(self) -> None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise DatabaseError(f"Kobo database not found at {self.path}")
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._stamp is not None and stamp != self._stamp:
+            logging.debug("Kobo database at %s changed; reconnecting", self.path)
+            self._close_idle()
+            self._generation += 1
+        self._stamp = stamp
+
+    def _close_idle(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._revalidate()
+            generation = self._generation
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                conn = None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                if generation == self._generation and self._idle.qsize() < self.max_idle:
+                    self._idle.put(conn)
+                else:
+                    conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_idle()
+            self._generation += 1
+
+
+_pools: dict[str, KoboConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_kobo_connection_pool(path: Optional[str] = None) -> KoboConnectionPool:
+    path = path or SQLITE_DB_PATH + SQLITE_DB_NAME
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = KoboConnectionPool(path)
+        return pool
+
+
+def kobo_connection(path: Optional[str] = None):
+    """`with kobo_connection() as conn:` borrows a read-only connection
+    to the Kobo database from its pool"""
+    return get_kobo_connection_pool(path).connection()
+
+
+def sync_kobo_mirror(kobo_db_path: str) -> MirrorChanges:
+    """Imports what changed in the Kobo database at `kobo_db_path` into the
+    mirror, and forgets what was resolved for highlights that changed
+    (so only those are located again)"""
+    try:
+        stamp = get_source_stamp(kobo_db_path)
+    except FileNotFoundError:
+        raise DatabaseError(f"Kobo database not found at {kobo_db_path}")
+    with borrow_mirror_connection() as conn:
+        if get_mirrored_source(conn) == (os.path.abspath(kobo_db_path), stamp):
+            return MirrorChanges()
+        with kobo_connection(kobo_db_path) as source:
+            changes = sync_mirror(conn, source, kobo_db_path, stamp)
+    forget_highlight_locations(changes.changed + changes.deleted)
+    forget_highlight_records(changes.changed + changes.deleted)
+    return changes
+
+
+@contextmanager
+def mirror_connection(kobo_db_path: Optional[str] = None) -> Iterator[sqlite3.Connection]:
+    """`with mirror_connection() as conn:` borrows a connection to the indexed
+    mirror of the Kobo database (see `utils/kobo_mirror.py`), synced first
+    if its source changed.
+    Without `kobo_db_path`, the source is whichever database was last synced
+    from (eg. the device itself, with `cli.py sync`); if it isn't there
+    anymore (the device was unmounted), the mirror is used as it is, unless
+    the copy at SQLITE_DB_PATH was written since it was last synced."""
+    with borrow_mirror_connection() as conn:
+        if kobo_db_path is None:
+            mirrored = get_mirrored_source(conn)
+            kobo_db_path = mirrored[0] if mirrored else SQLITE_DB_PATH + SQLITE_DB_NAME
+            if mirrored and not os.path.exists(kobo_db_path):
+                if is_newer_than_last_sync(conn, SQLITE_DB_PATH + SQLITE_DB_NAME):
+                    logging.info("%s is not available; syncing from the newer copy at %s",
+                                 kobo_db_path, SQLITE_DB_PATH + SQLITE_DB_NAME)
+                    kobo_db_path = SQLITE_DB_PATH + SQLITE_DB_NAME
+                else:
+                    logging.debug("%s is not available; using the mirror as it is", kobo_db_path)
+                    kobo_db_path = None
+        if kobo_db_path is not None:
+            sync_kobo_mirror(kobo_db_path)
+        yield conn
+
+
+@dataclass(frozen=True)
+class HighlightRecord:
+    """A highlight as the mirror has it, with its book's details"""
+    bookmark_id: str
+    title: Optional[str]
+    author: Optional[str]
+    text: Optional[str]
+    date_created: Optional[str]
+    start_container_path: Optional[str]
+    end_container_path: Optional[str]
+    volume_id: str
+
+    @property
+    def filename(self) -> str:
+        return self.volume_id.split('/')[-1]
+
+    @property
+    def section(self) -> str:
+        return (self.start_container_path or '').split('#')[0]
+
+
+HIGHLIGHT_RECORD_COLUMNS = """
+        highlights.bookmark_id,
+        books.title,
+        books.author,
+        highlights.text,
+        highlights.date_created,
+        highlights.start_container_path,
+        highlights.end_container_path,
+        highlights.volume_id
+"""
+
+# every highlight record fetched this session, by id; the highlights list of
+# a book fills it in one query, so opening any of them needs no other query.
+# Records of highlights that change on the device are dropped on sync.
+_highlight_records: dict[str, HighlightRecord] = {}
+_highlight_records_lock = threading.Lock()
+
+
+def forget_highlight_records(bookmark_ids: list[str]) -> None:
+    with _highlight_records_lock:
+        for bookmark_id in bookmark_ids:
+            _highlight_records.pop(bookmark_id, None)
+
+
+def get_highlight_records_of_book(filename: str) -> list[HighlightRecord]:
+    """Every highlight of a book, oldest first"""
+    with mirror_connection() as conn:
+        rows = conn.execute(f"""
+        SELECT {HIGHLIGHT_RECORD_COLUMNS}
+        FROM books
+        JOIN highlights ON highlights.volume_id = books.volume_id
+        WHERE books.filename = ?
+        ORDER BY highlights.date_created
+        """, (filename,)).fetchall()
+    records = [HighlightRecord(*row) for row in rows]
+    with _highlight_records_lock:
+        _highlight_records.update((record.bookmark_id, record) for record in records)
+    return records
+
+
+def get_highlight_record(highlight_id: str) -> Optional[HighlightRecord]:
+    """A highlight's record, only queried if it wasn't fetched before"""
+    with _highlight_records_lock:
+        record = _highlight_records.get(highlight_id)
+    if record is not None:
+        return record
+    with mirror_connection() as conn:
+        row = conn.execute(f"""
+        SELECT {HIGHLIGHT_RECORD_COLUMNS}
+        FROM highlights
+        LEFT OUTER JOIN books ON books.volume_id = highlights.volume_id
+        WHERE highlights.bookmark_id = ?
+        """, (highlight_id,)).fetchone()
+    if row is None:
+        return None
+    record = HighlightRecord(*row)
+    with _highlight_records_lock:
+        _highlight_records[highlight_id] = record
+    return record
+
+
 def get_book_details_from_book_name(book_name: str) -> tuple[str, str, str]:
     """
     Get the filename, title, and author for a book from its name.
@@ -41,28 +272,14 @@ def get_book_details_from_book_name(book_name: str) -> tuple[str, str, str]:
         DatabaseError: If there's an error accessing the database
     """
     try:
-        conn = create_connection_to_database(SQLITE_DB_PATH + SQLITE_DB_NAME)
-        if not conn:
-            raise DatabaseError("Could not connect to database")
-            
-        c = conn.cursor()
-        
-        # Get all relevant fields from the database
-        c.execute("""
-            SELECT 
-                content.BookId,
-                content.Title as BookTitle,
-                content.Attribution as BookAuthor,
-                content.ContentID  -- Adding ContentID as a fallback
-            FROM content 
-            WHERE content.Title LIKE ? 
-            OR content.Title LIKE ?
-        """, (
-            f"%{book_name}%",
-            f"%{book_name.split(' by ')[0]}%"
-        ))
-        
-        result = c.fetchall()
+        with mirror_connection() as conn:
+            # Get all relevant fields from the database
+            result = conn.execute("""
+                SELECT book_id, title, author, volume_id
+                FROM books
+                WHERE title = ? OR title = ?
+            """, (book_name, book_name.split(' by ')[0])).fetchall()
+
         if not result:
             raise BookNotFoundError(f"No book found with title: {book_name}")
             
@@ -71,7 +288,8 @@ def get_book_details_from_book_name(book_name: str) -> tuple[str, str, str]:
         # Try to get a valid identifier (either BookId or ContentID)
         identifier = book_id if book_id else content_id
         if not identifier:
-            logging.error(f"Book found but no valid identifier. Title: {title}, Author: {author}")
+            logging.error("Book found but no valid identifier. Title: %s, Author: %s",
+                          title, author)
             raise BookNotFoundError(f"Book metadata exists but no valid identifier found: {title}")
             
         filename = identifier.split('/')[-1]
@@ -86,12 +304,8 @@ def get_book_details_from_book_name(book_name: str) -> tuple[str, str, str]:
         return filename, title, author
         
     except sqlite3.Error as e:
-        logging.error(f"Database error for book '{book_name}': {str(e)}")
+        logging.error("Database error for book '%s': %s", book_name, e)
         raise DatabaseError(f"Database error: {str(e)}")
-        
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
 
 
 # returns a list with
@@ -113,37 +327,15 @@ def get_all_highlights_of_book_from_database(
         DatabaseError: If there's an error accessing the database
     """
     try:
-        conn = create_connection_to_database(SQLITE_DB_PATH + SQLITE_DB_NAME)
-        if not conn:
-            raise DatabaseError("Could not connect to database")
-            
-        c = conn.cursor()
-        
-        # Get highlights using ContentID (which contains the filename)
-        c.execute("""
-            SELECT
-                Bookmark.Text,
-                Bookmark.DateCreated,
-                BookmarkID,
-                StartContainerPath
-            FROM "Bookmark"
-            LEFT OUTER JOIN content
-            ON (content.contentID=Bookmark.VolumeID and content.ContentType=6)
-            WHERE content.ContentID LIKE ?
-            ORDER BY Bookmark.DateCreated
-        """, (f"%{filename}%",))
-        
-        all_highlights = c.fetchall()
-        logging.debug(f"Found {len(all_highlights)} highlights for book '{filename}'")
+        all_highlights = [(record.text, record.date_created,
+                           record.bookmark_id, record.start_container_path)
+                          for record in get_highlight_records_of_book(filename)]
+        logging.debug("Found %s highlights for book '%s'", len(all_highlights), filename)
         return all_highlights
         
     except sqlite3.Error as e:
-        logging.error(f"Database error getting highlights for '{filename}': {str(e)}")
+        logging.error("Database error getting highlights for '%s': %s", filename, e)
         raise DatabaseError(f"Database error: {str(e)}")
-        
-    finally:
-        if 'conn' in locals() and conn:
-            conn.close()
 
 
 # returns a list with
@@ -152,74 +344,96 @@ def get_all_highlights_of_book_from_database(
 def get_highlight_from_database(
         highlight_id: str
         ) -> tuple:
-    conn = create_connection_to_database(SQLITE_DB_PATH + SQLITE_DB_NAME)
-    c = conn.cursor()
-    c.execute(f"""
-    SELECT
-    content.title as BookTitle,
-    content.attribution as BookAuthor,
-    Bookmark.Text,
-    Bookmark.DateCreated,
-    StartContainerPath,
-    Bookmark.VolumeID
-    FROM "Bookmark"
-    LEFT OUTER JOIN content
-    ON (content.contentID=Bookmark.VolumeID and content.ContentType=6)
-    WHERE
-    BookmarkID="{highlight_id}"
-    """)
+    record = get_highlight_record(highlight_id)
+    if record is None:
+        raise IndexError(f"No highlight with id {highlight_id}")
+    fixed_path = record.filename
+    if fixed_path[-5:] != '.epub':
+        raise FileNotFoundError
     # 240106: there was a bug in matching certain quotes;
     # it was due to `quote_to_expand` being preceded by whitespace.
     # the `.strip()` seems to be a fix.
-    content = c.fetchall()[0]
-    fixed_path = content[5].split('/')[-1]
-    content = list(content[:5]) + [fixed_path]
-    if fixed_path[-5:] != '.epub':
-        raise FileNotFoundError
-    conn.close()
-    content[2] = content[2].strip()
-    # Validate before returning
+    highlight = record.text.strip()
+    # Validate before returning; imported here, as it loads the epub parsers
+    from utils.epub_validation import validate_epub_structure
     is_valid, error_msg = validate_epub_structure(fixed_path)
     if not is_valid:
-        logging.warning(f"Book {fixed_path} has invalid structure: {error_msg}")
-    return (content[0], content[1], content[2], content[3], content[4], fixed_path)
+        logging.warning("Book %s has invalid structure: %s", fixed_path, error_msg)
+    return (record.title, record.author, highlight, record.date_created,
+            record.start_container_path, fixed_path)
+
+
+# returns the start and end container paths of a highlight, eg.
+# ('text/part0011.html#point(/1/4/192/3:147)', 'text/part0011.html#point(/1/4/192/3:528)')
+def get_highlight_container_paths_from_database(
+        highlight_id: str
+        ) -> tuple[str, str]:
+    record = get_highlight_record(highlight_id)
+    if record is None:
+        return None
+    return record.start_container_path, record.end_container_path
+
+
+# keyset pagination: each page starts right after the last row of the
+# previous one, so fetching any page is an index seek (no OFFSET scans)
+def get_page_of_highlight_records(
+        filename: str,
+        after: Optional[tuple[str, str]] = None,
+        limit: int = LIST_PAGE_SIZE
+        ) -> list[HighlightRecord]:
+    """Up to `limit` highlights of a book, oldest first, following
+    the (date_created, bookmark_id) of the last one of the previous page"""
+    with mirror_connection() as conn:
+        rows = conn.execute(f"""
+        SELECT {HIGHLIGHT_RECORD_COLUMNS}
+        FROM books
+        JOIN highlights ON highlights.volume_id = books.volume_id
+        WHERE books.filename = ?
+        AND (highlights.date_created, highlights.bookmark_id) > (?, ?)
+        ORDER BY highlights.date_created, highlights.bookmark_id
+        LIMIT ?
+        """, (filename, *(after or ('', '')), limit)).fetchall()
+    records = [HighlightRecord(*row) for row in rows]
+    with _highlight_records_lock:
+        _highlight_records.update((record.bookmark_id, record) for record in records)
+    return records
+
+
+def get_page_of_highlighted_books(
+        after: Optional[tuple[str, str]] = None,
+        limit: int = LIST_PAGE_SIZE
+        ) -> list[tuple[str, str, str, str, str]]:
+    """Up to `limit` books as (title, author, filename, last_highlight_date,
+    volume_id), most recently highlighted first, following the
+    (last_highlight_date, volume_id) of the last one of the previous page"""
+    with mirror_connection() as conn:
+        if after is None:
+            return conn.execute("""
+            SELECT title, author, filename, last_highlight_date, volume_id
+            FROM books
+            WHERE author IS NOT NULL
+            ORDER BY last_highlight_date DESC, volume_id DESC
+            LIMIT ?
+            """, (limit,)).fetchall()
+        return conn.execute("""
+        SELECT title, author, filename, last_highlight_date, volume_id
+        FROM books
+        WHERE author IS NOT NULL
+        AND (last_highlight_date, volume_id) < (?, ?)
+        ORDER BY last_highlight_date DESC, volume_id DESC
+        LIMIT ?
+        """, (*after, limit)).fetchall()
 
 
 # returns a list of lists of three strings
 def get_list_of_highlighted_books(
-        sqlite_db_path: str
+        sqlite_db_path: Optional[str] = None
         ) -> list[list[str, str, str]]:
-    def take_epub_file_name_from_path(path: str):
-        return path.split('/')[-1]
-    conn = create_connection_to_database(sqlite_db_path)
-    c = conn.cursor()
-    c.execute("""
-    WITH LatestHighlights AS (
-        SELECT 
-            content.ContentID,
-            MAX(Bookmark.DateCreated) as LastHighlightDate
-        FROM "Bookmark"
-        LEFT OUTER JOIN content
-        ON (content.contentID=Bookmark.VolumeID and content.ContentType=6)
-        GROUP BY content.ContentID
-    )
-    SELECT DISTINCT
-        content.Title as BookTitle,
-        content.Attribution,
-        content.ContentID,
-        lh.LastHighlightDate
-    FROM "Bookmark"
-    LEFT OUTER JOIN content
-    ON (content.contentID=Bookmark.VolumeID and content.ContentType=6)
-    LEFT OUTER JOIN LatestHighlights lh
-    ON content.ContentID = lh.ContentID
-    WHERE content.Attribution IS NOT NULL
-    ORDER BY lh.LastHighlightDate DESC
-    """)
-    results = c.fetchall()  # Fetch all results
-    conn.close()
-    parsed = [
-            [title, author, take_epub_file_name_from_path(file)]
-            for title, author, file, _ in results
-            ]
-    return parsed
+    with mirror_connection(sqlite_db_path) as conn:
+        rows = conn.execute("""
+        SELECT title, author, filename
+        FROM books
+        WHERE author IS NOT NULL
+        ORDER BY last_highlight_date DESC
+        """).fetchall()
+    return [list(row) for row in rows]
@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from ebooklib import epub
+from utils.const import EPUB_CACHE_MAX_BYTES
+from utils.logging import logging
+
+
+def get_epub_fingerprint(path: str) -> str:
+    """Cheap identity of an epub file's contents, used to key
+    anything derived from it (here and in the persistent caches)"""
+    stat = Path(path).stat()
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+class ParsedBook:
+    """An `epub.EpubBook` parsed once, together with the file
+    fingerprint (size and mtime) it was parsed from.
+    Used where the whole book is needed (TOC, cover); single sections
+    are cheaper to get through `utils/epub_reader.py`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fingerprint = get_epub_fingerprint(path)
+        size = Path(path).stat().st_size
+        self.book = epub.read_epub(path, {'ignore_ncx': True})
+        # rough memory footprint: every item is held decompressed
+        self.nbytes = size + sum(len(item.content or b'')
+                                 for item in self.book.get_items())
+
+    @property
+    def toc(self):
+        return self.book.toc
+
+
+class ParsedBookCache:
+    """Process-wide LRU of `ParsedBook`s, keyed by path;
+    an entry is only reused while the file keeps its mtime and size.
+    Least recently used books are evicted once the byte budget is exceeded
+    (the most recent book is always kept, however big)."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._books: OrderedDict[str, ParsedBook] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = Lock()
+
+    def get(self, path: str) -> ParsedBook:
+        key = str(Path(path).resolve())
+        fingerprint = get_epub_fingerprint(key)
+        with self._lock:
+            cached = self._books.get(key)
+            if cached is not None and cached.fingerprint == fingerprint:
+                self._books.move_to_end(key)
+                return cached
+        # parse outside the lock; two threads racing on the same
+        # book will both parse it, and the last one wins
+        logging.debug("Parsing epub: %s", key)
+        parsed = ParsedBook(key)
+        with self._lock:
+            self._discard(key)
+            self._books[key] = parsed
+            self._total_bytes += parsed.nbytes
+            self._evict()
+        return parsed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._books.clear()
+            self._total_bytes = 0
+
+    def _discard(self, key: str) -> None:
+        old = self._books.pop(key, None)
+        if old is not None:
+            self._total_bytes -= old.nbytes
+
+    def _evict(self) -> None:
+        while self._total_bytes > self.max_bytes and len(self._books) > 1:
+            key, evicted = self._books.popitem(last=False)
+            self._total_bytes -= evicted.nbytes
+            logging.debug("Evicted parsed epub from cache: %s", key)
+
+
+_parsed_book_cache = ParsedBookCache(EPUB_CACHE_MAX_BYTES)
+
+
+def get_parsed_book(path: str) -> ParsedBook:
+    """Returns the parsed book at `path`, reading the file only
+    if it isn't cached yet or has changed since it was parsed.
+    Raises FileNotFoundError if there is no such file."""
+    return _parsed_book_cache.get(path)
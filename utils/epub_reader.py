@@ -0,0 +1,189 @@
+import posixpath
+import queue
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+from urllib.parse import unquote
+from zipfile import ZipFile
+from utils.const import (
+    EPUB_READER_HANDLES,
+    EPUB_READER_MEMBERS_MAX_BYTES,
+    EPUB_READERS_MAX,
+)
+from utils.epub_cache import get_epub_fingerprint
+from utils.logging import logging
+
+CONTAINER_PATH = 'META-INF/container.xml'
+DC_NAMESPACE = 'http://purl.org/dc/elements/1.1/'
+
+
+class EpubZipReader:
+    """Reads single members of an epub straight from the zip file.
+    Only the container and OPF are parsed up front; sections are
+    decompressed when asked for, and the most recently read ones are
+    kept in memory. Up to EPUB_READER_HANDLES `ZipFile`s are kept open,
+    so background workers can read from the same book concurrently."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fingerprint = get_epub_fingerprint(path)
+        self._idle_handles = queue.LifoQueue()
+        self._opened_handles = []
+        self._handles_lock = threading.Lock()
+        self._members = OrderedDict()
+        self._members_bytes = 0
+        self._members_lock = threading.Lock()
+        with self._handle() as zf:
+            self.sizes = {info.filename: info.file_size for info in zf.infolist()}
+            self.opf_path = self._find_opf_path(zf)
+            opf = ET.fromstring(zf.read(self.opf_path))
+        self.opf_dir = posixpath.dirname(self.opf_path)
+        self.has_title = opf.find(f'.//{{{DC_NAMESPACE}}}title') is not None
+        # manifest, as `ebooklib` names its items: href relative to the OPF
+        self.manifest = {}
+        self.manifest_ids = {}
+        for item in opf.findall('.//{*}manifest/{*}item'):
+            href = unquote(item.get('href', ''))
+            self.manifest[href] = posixpath.normpath(posixpath.join(self.opf_dir, href))
+            self.manifest_ids[item.get('id')] = href
+        self.spine = [self.manifest_ids[itemref.get('idref')]
+                      for itemref in opf.findall('.//{*}spine/{*}itemref')
+                      if itemref.get('idref') in self.manifest_ids]
+        self.cover_href = self._find_cover_href(opf)
+
+    @staticmethod
+    def _find_opf_path(zf: ZipFile) -> str:
+        container = ET.fromstring(zf.read(CONTAINER_PATH))
+        rootfile = container.find('.//{*}rootfile')
+        if rootfile is None:
+            raise ValueError("No rootfile in container.xml")
+        return rootfile.get('full-path')
+
+    def _find_cover_href(self, opf: ET.Element) -> Optional[str]:
+        """The cover image, as the OPF metadata names it (epub 2 or 3), or
+        else the first image with 'cover' in its name"""
+        for meta in opf.findall('.//{*}metadata/{*}meta'):
+            if meta.get('name') == 'cover' and meta.get('content') in self.manifest_ids:
+                return self.manifest_ids[meta.get('content')]
+        for item in opf.findall('.//{*}manifest/{*}item'):
+            if 'cover-image' in (item.get('properties') or '').split():
+                return unquote(item.get('href', ''))
+        return next((href for href in self.manifest
+                     if 'cover' in href.lower()
+                     and href.lower().endswith(('.jpg', '.jpeg', '.png'))), None)
+
+    @contextmanager
+    def _handle(self):
+        """Borrows an open `ZipFile` from the pool, opening
+        a new one if all are busy and the pool isn't full yet."""
+        try:
+            zf = self._idle_handles.get_nowait()
+        except queue.Empty:
+            with self._handles_lock:
+                can_open = len(self._opened_handles) < EPUB_READER_HANDLES
+                if can_open:
+                    zf = ZipFile(self.path, 'r')
+                    self._opened_handles.append(zf)
+            if not can_open:
+                zf = self._idle_handles.get()
+        try:
+            yield zf
+        finally:
+            self._idle_handles.put(zf)
+
+    def close(self) -> None:
+        with self._handles_lock:
+            for zf in self._opened_handles:
+                zf.close()
+            self._opened_handles.clear()
+        self._idle_handles = queue.LifoQueue()
+
+    def validate(self) -> tuple[bool, str]:
+        """Validates basic epub structure and returns (is_valid, error_message),
+        without decompressing anything but the OPF"""
+        if not self.spine:
+            return False, "No spine items found in epub"
+
+        if not self.has_title:
+            return False, "No title metadata found"
+
+        # Check if all referenced sections exist
+        for href, member in self.manifest.items():
+            if not self.sizes.get(member):
+                return False, f"Empty or invalid content in section: {href}"
+
+        return True, "Valid epub structure"
+
+    def find_section_href(self, section_path: str) -> Optional[str]:
+        """Kobo section paths don't always match the manifest
+        (eg. they might carry the OPF directory); this tries the path
+        and each of its suffixes, like `get_full_context_from_highlight` did."""
+        path_parts = unquote(section_path).split('/')
+        for i in range(len(path_parts)):
+            variant = '/'.join(path_parts[i:])
+            if variant in self.manifest:
+                logging.debug("Found section using path: %s", variant)
+                return variant
+        return None
+
+    def read_member(self, member: str) -> bytes:
+        with self._members_lock:
+            content = self._members.get(member)
+            if content is not None:
+                self._members.move_to_end(member)
+                return content
+        with self._handle() as zf:
+            content = zf.read(member)
+        with self._members_lock:
+            if member not in self._members:
+                self._members[member] = content
+                self._members_bytes += len(content)
+            while self._members_bytes > EPUB_READER_MEMBERS_MAX_BYTES and len(self._members) > 1:
+                _, evicted = self._members.popitem(last=False)
+                self._members_bytes -= len(evicted)
+        return content
+
+    @contextmanager
+    def open_member(self, member: str):
+        """A file object to stream a member (eg. an image) from, without
+        reading it into memory or keeping it in the members cache"""
+        with self._handle() as zf:
+            with zf.open(member) as file:
+                yield file
+
+    def read_section(self, section_path: str) -> Optional[bytes]:
+        """Content of the manifest item matching `section_path`, or None"""
+        href = self.find_section_href(section_path)
+        if href is None:
+            return None
+        return self.read_member(self.manifest[href])
+
+
+_readers: OrderedDict[str, EpubZipReader] = OrderedDict()
+_readers_lock = threading.Lock()
+
+
+def get_epub_reader(path: str) -> EpubZipReader:
+    """Returns a reader for the epub at `path`, reusing the open one
+    unless the file has changed. Least recently used readers (and
+    their zip handles) are closed beyond EPUB_READERS_MAX books."""
+    key = str(Path(path).resolve())
+    fingerprint = get_epub_fingerprint(key)
+    with _readers_lock:
+        reader = _readers.get(key)
+        if reader is not None and reader.fingerprint == fingerprint:
+            _readers.move_to_end(key)
+            return reader
+    reader = EpubZipReader(key)
+    with _readers_lock:
+        stale = _readers.pop(key, None)
+        if stale is not None:
+            stale.close()
+        _readers[key] = reader
+        while len(_readers) > EPUB_READERS_MAX:
+            _, evicted = _readers.popitem(last=False)
+            evicted.close()
+    return reader
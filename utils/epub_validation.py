@@ -1,85 +1,108 @@
-from ebooklib import epub
+from collections import OrderedDict
 from pathlib import Path
-from functools import lru_cache
+from threading import Lock
+from typing import Optional
 from utils.logging import logging
 from bs4 import BeautifulSoup
 from utils.const import BOOKS_DIR
 from urllib.parse import unquote
+from utils.epub_cache import get_epub_fingerprint
+from utils.epub_reader import get_epub_reader
+from utils.cache_store import get_section, put_section_text
+from utils.sentence_index import (
+    SentenceIndex,
+    remember_sentence_index,
+    )
+
+# parsed documents of the most recently used sections
+SECTION_DOMS_MAX = 4
+_section_doms: OrderedDict[tuple, BeautifulSoup] = OrderedDict()
+_section_doms_lock = Lock()
 
 
-@lru_cache(maxsize=100)
 def validate_epub_structure(book_path: str) -> tuple[bool, str]:
     """
-    Validates basic epub structure and returns (is_valid, error_message)
+    Validates basic epub structure and returns (is_valid, error_message);
+    only the OPF is read, and sections are checked through the zip directory.
     """
     full_path = Path(BOOKS_DIR) / book_path
     if not full_path.exists():
         return False, f"Book file not found: {full_path}"
     
     try:
-        book = epub.read_epub(str(full_path))
-        
-        # Check if book has basic required elements
-        if not book.spine:
-            return False, "No spine items found in epub"
-            
-        if not book.get_metadata('DC', 'title'):
-            return False, "No title metadata found"
-            
-        # Check if all referenced sections exist
-        for item in book.get_items():
-            if hasattr(item, 'get_content'):
-                if not item.get_content():
-                    return False, f"Empty or invalid content in section: {item.get_name()}"
-                    
-        return True, "Valid epub structure"
+        return get_epub_reader(str(full_path)).validate()
         
     except Exception as e:
         return False, f"Error validating epub: {str(e)}" 
 
+def get_section_dom(
+        book_path: str,
+        section_path: str
+        ) -> Optional[BeautifulSoup]:
+    """The parsed document of a section, or None if the book has no such section;
+    the last few are kept in memory, for resolving highlight positions in them"""
+    book_path = str(Path(book_path).resolve())
+    section_path = unquote(section_path)
+    key = (book_path, get_epub_fingerprint(book_path), section_path)
+    with _section_doms_lock:
+        dom = _section_doms.get(key)
+        if dom is not None:
+            _section_doms.move_to_end(key)
+            return dom
+    # only the section's own zip member is decompressed
+    content = get_epub_reader(book_path).read_section(section_path)
+    if content is None:
+        return None
+    dom = BeautifulSoup(content, 'html.parser')
+    with _section_doms_lock:
+        _section_doms[key] = dom
+        while len(_section_doms) > SECTION_DOMS_MAX:
+            _section_doms.popitem(last=False)
+    return dom
+
+
 # provides the full content of the .html file
 # in which a given highlight can be found. Highlights in Kobo
 # will carry information about the section in which they are.
 # Then, the highlight must be found inside the section
 # (and the section can be quite big).
+# The extracted text (and its sentence offsets) is kept in the cache database,
+# so reopening a highlight from an unchanged book skips parsing altogether.
 def get_full_context_from_highlight(
         book_path: str,
         section_path: str
         ) -> str:
+    try:
+        book_path = str(Path(book_path).resolve())
+        fingerprint = get_epub_fingerprint(book_path)
+    except OSError as e:
+        logging.error("Could not access epub: %s", e)
+        return None
+    cached = get_section(book_path, unquote(section_path), fingerprint)
+    if cached is not None:
+        cached_soup, sentence_offsets = cached
+        remember_sentence_index(SentenceIndex.from_bytes(cached_soup, sentence_offsets))
+        return cached_soup
+
     # First validate the epub
     is_valid, error_msg = validate_epub_structure(book_path)
     if not is_valid:
-        logging.error(f"Invalid epub structure: {error_msg}")
+        logging.error("Invalid epub structure: %s", error_msg)
         return None
 
-    book = epub.read_epub(book_path, {"ignore_ncx": True})
-    
-    # Try different path variations systematically
     original_path = unquote(section_path)
-    section = None
-    path_variations = []
-    
-    # Build list of possible paths
-    path_parts = original_path.split('/')
-    for i in range(len(path_parts)):
-        variant = '/'.join(path_parts[i:])
-        path_variations.append(variant)
-    
-    # Try each variation
-    for path in path_variations:
-        logging.debug(f"Trying to find section with path: {path}")
-        section = book.get_item_with_href(path)
-        if section:
-            logging.debug(f"Found section using path: {path}")
-            break
-    
-    if section is None:
-        logging.error(f"Could not find section. Tried variations of: {original_path}")
-        return None
-
     try:
-        soup = BeautifulSoup(section.get_content(), 'html.parser').get_text()
+        parsed = get_section_dom(book_path, original_path)
+        if parsed is None:
+            logging.error("Could not find section. Tried variations of: %s", original_path)
+            return None
+        # `ebooklib` used to hand us the body only (no <title> text)
+        soup = (parsed.body or parsed).get_text()
+        sentence_index = SentenceIndex.from_text(soup)
+        remember_sentence_index(sentence_index)
+        put_section_text(book_path, original_path, fingerprint, soup,
+                         sentence_index.to_bytes())
         return soup
     except Exception as e:
-        logging.error(f"Error parsing section content: {str(e)}")
+        logging.error("Error parsing section content: %s", e)
         return None
\ No newline at end of file
@@ -1,16 +1,31 @@
-from ebooklib import epub
-import re
 from utils.const import (
         BOOKS_DIR
         )
 from utils.logging import logging
 from utils.epub_validation import (
     get_full_context_from_highlight,
+    get_section_dom,
     )
 from utils.database import (
     get_highlight_from_database,
+    get_highlight_container_paths_from_database,
+    )
+from utils.point_path import (
+    parse_point_path,
+    resolve_point_in_dom,
     )
 from urllib.parse import unquote
+from utils.cache_store import (
+    HighlightLocation,
+    get_highlight_location,
+    put_highlight_location,
+    )
+from utils.epub_cache import get_epub_fingerprint
+from utils.highlight_locator import locate_fragments
+from utils.sentence_index import (
+    SENTENCE_BOUNDARY,
+    get_sentence_index,
+    )
 
 
 def get_index_of_sentence_in_sentences_list(
@@ -24,24 +39,14 @@ def get_index_of_sentence_in_sentences_list(
 
 
 def break_string_into_list_of_sentences(string: str):
-    # pattern to break a string (soup or highlight) into a list of sentences,
+    # breaks a string (soup or highlight) into a list of sentences,
     # using the period ('.') and other punctiation as delimiter.
-    pattern = r"(?<=[.!?])\s*(?=•|\w)"
-    return re.split(pattern, string)
+    return SENTENCE_BOUNDARY.split(string)
 
 
 
-# NOTE the soup is the whole context of the quote.
-# this function retrieves the sentence or paragraph containing the quote,
-# In the case of the first or last sentence of the highlight being incomplete,
-# the function will try to get the beginning and/or end of enclosing sentence.
-# FIXME it can handle the span of two paragraphs (many is still to be implemented)
-def get_start_and_end_of_highlight(
-        soup: str,
-        highlight: str
-        ) -> list[str]:
+def get_start_and_end_fragments_of_highlight(highlight: str) -> tuple[str, str]:
     highlight_sentences = break_string_into_list_of_sentences(highlight)
-    broken_soup = break_string_into_list_of_sentences(soup)
     # NOTE I feel something could be done here
     if len(highlight_sentences) == 1:
         pass
@@ -54,17 +59,195 @@ def get_start_and_end_of_highlight(
     # FIXME there should also be a test for
     # the same happening at the beginning
     end_of_highlight = highlight_sentences[-1]
-    if len(end_of_highlight.split()) == 1:
+    if len(end_of_highlight.split()) == 1 and len(highlight_sentences) > 1:
         end_of_highlight = highlight_sentences[-2]
+    return start_of_highlight, end_of_highlight
+
+
+# NOTE the soup is the whole context of the quote.
+# this function retrieves the sentence or paragraph containing the quote,
+# In the case of the first or last sentence of the highlight being incomplete,
+# the function will try to get the beginning and/or end of enclosing sentence.
+# FIXME it can handle the span of two paragraphs (many is still to be implemented)
+def get_start_and_end_of_highlight(
+        soup: str,
+        highlight: str
+        ) -> list[str]:
+    [paragraphs] = get_start_and_end_of_highlights(soup, [highlight])
+    if paragraphs is None:
+        # same as `get_index_of_sentence_in_sentences_list` on a miss
+        raise StopIteration
+    return paragraphs
+
+
+# resolves all highlights of a section at once: every start and end fragment
+# is looked up in a single pass over the soup (see `utils/highlight_locator.py`).
+# returns the indices of the first and last sentence of each highlight,
+# or None for highlights that can't be found.
+def locate_highlights_in_soup(
+        soup: str,
+        highlights: list[str]
+        ) -> list[tuple[int, int] | None]:
+    sentence_index = get_sentence_index(soup)
+    fragments = [get_start_and_end_fragments_of_highlight(highlight)
+                 for highlight in highlights]
+    located = locate_fragments(sentence_index,
+                               [fragment for pair in fragments for fragment in pair])
+    return [(located[start_of_highlight], located[end_of_highlight])
+            if start_of_highlight in located and end_of_highlight in located
+            else None
+            for start_of_highlight, end_of_highlight in fragments]
+
+
+def get_start_and_end_of_highlights(
+        soup: str,
+        highlights: list[str]
+        ) -> list[list[str] | None]:
+    sentence_index = get_sentence_index(soup)
+    return [sentence_index.sentences(span[0], span[1] + 1) if span else None
+            for span in locate_highlights_in_soup(soup, highlights)]
+
+
+# number of characters compared when checking that a point path
+# really lands on the highlight's start (or end)
+POINT_CHECK_LENGTH = 32
+
+
+def _normalize_whitespace(string: str) -> str:
+    return ' '.join(string.split())
+
+
+# Kobo stores where each highlight starts and ends (`StartContainerPath`,
+# `EndContainerPath`); this resolves both to offsets into the soup,
+# and returns the sentences enclosing them. Returns None if the paths
+# can't be resolved, or don't land on the highlight's text
+# (the epub on the device might not be the same as the one on disk).
+def get_highlight_offsets_from_container_paths(
+        book_path: str,
+        soup: str,
+        highlight: str,
+        start_container_path: str,
+        end_container_path: str
+        ) -> tuple[int, int] | None:
+    start_point = parse_point_path(start_container_path)
+    end_point = parse_point_path(end_container_path)
+    if (start_point is None or end_point is None
+            or start_point.section != end_point.section):
+        return None
+    dom = get_section_dom(book_path, start_point.section)
+    if dom is None:
+        return None
+    start = resolve_point_in_dom(dom, start_point)
+    end = resolve_point_in_dom(dom, end_point)
+    if start is None or end is None or end < start:
+        return None
+    expected = _normalize_whitespace(highlight)
+    window = POINT_CHECK_LENGTH * 2
+    if not (_normalize_whitespace(soup[start:start + window]).startswith(expected[:POINT_CHECK_LENGTH])
+            and _normalize_whitespace(soup[max(end - window, 0):end]).endswith(expected[-POINT_CHECK_LENGTH:])):
+        logging.debug("Container paths don't match the highlight text: %s", start_container_path)
+        return None
+    return start, end
+
+
+# returns the indices of the first and last sentence
+# enclosing the [start, end) offsets of the soup
+def get_highlight_sentence_span_from_offsets(
+        soup: str,
+        start: int,
+        end: int
+        ) -> tuple[int, int]:
+    sentence_index = get_sentence_index(soup)
+    # points often sit in the whitespace between paragraphs
+    while start < end and soup[start].isspace():
+        start += 1
+    while end > start and soup[end - 1].isspace():
+        end -= 1
+    # the end offset is exclusive; a highlight ending on a period
+    # shouldn't pull in the following sentence
+    return (sentence_index.sentence_at(start),
+            sentence_index.sentence_at(max(end - 1, start)))
 
-    [match_start_index, _] = (
-            get_index_of_sentence_in_sentences_list(start_of_highlight,
-                                                    broken_soup))
-    [match_end_index, _] = (
-            get_index_of_sentence_in_sentences_list(end_of_highlight,
-                                                    broken_soup))
 
-    return broken_soup[match_start_index:match_end_index + 1]
+def get_highlight_sentences_from_offsets(
+        soup: str,
+        start: int,
+        end: int
+        ) -> list[str]:
+    first, last = get_highlight_sentence_span_from_offsets(soup, start, end)
+    return get_sentence_index(soup).sentences(first, last + 1)
+
+
+# finds where each highlight of a section is in its soup: the container paths
+# are tried first, and the rest are looked up together by text search.
+# `highlights` are (highlight_id, highlight, start_container_path, end_container_path);
+# highlights that can't be found are returned as None.
+def locate_highlights_of_section(
+        book_path: str,
+        soup: str,
+        highlights: list[tuple[str, str, str, str]]
+        ) -> list[HighlightLocation | None]:
+    fingerprint = get_epub_fingerprint(book_path)
+    sentence_index = get_sentence_index(soup)
+    locations = []
+    unresolved = []
+    for i, (highlight_id, highlight, start_container_path, end_container_path) in enumerate(highlights):
+        location = HighlightLocation(highlight_id, fingerprint,
+                                     start_container_path.split('#')[0])
+        offsets = get_highlight_offsets_from_container_paths(
+                book_path, soup, highlight,
+                start_container_path, end_container_path)
+        if offsets is not None:
+            location.start_offset, location.end_offset = offsets
+            location.start_sentence, location.end_sentence = (
+                    get_highlight_sentence_span_from_offsets(soup, *offsets))
+        else:
+            unresolved.append(i)
+        locations.append(location)
+    spans = locate_highlights_in_soup(soup, [highlights[i][1] for i in unresolved])
+    for i, span in zip(unresolved, spans):
+        if span is None:
+            locations[i] = None
+            continue
+        location = locations[i]
+        location.start_sentence, location.end_sentence = span
+        location.start_offset = sentence_index.starts[location.start_sentence]
+        location.end_offset = sentence_index.ends[location.end_sentence]
+    return locations
+
+
+# same as above, for a single highlight
+# (raising StopIteration on a miss, like `get_start_and_end_of_highlight`).
+def locate_highlight(
+        highlight_id: str,
+        highlight: str,
+        book_path: str,
+        soup: str
+        ) -> HighlightLocation:
+    start_container_path, end_container_path = (
+            get_highlight_container_paths_from_database(highlight_id))
+    [location] = locate_highlights_of_section(
+            book_path, soup,
+            [(highlight_id, highlight, start_container_path, end_container_path)])
+    if location is None:
+        raise StopIteration
+    return location
+
+
+# where a highlight is in its book; resolved once per version of the epub,
+# and then kept in the cache database.
+def get_highlight_location_from_id(
+        highlight_id: str,
+        highlight: str,
+        book_path: str,
+        soup: str
+        ) -> HighlightLocation:
+    location = get_highlight_location(highlight_id, get_epub_fingerprint(book_path))
+    if location is not None and location.is_located:
+        return location
+    location = locate_highlight(highlight_id, highlight, book_path, soup)
+    put_highlight_location(location)
+    return location
 
 
 # provides the highlight with the minimum surrounding context
@@ -78,26 +261,30 @@ def get_highlight_context_from_id(
     soup = get_full_context_from_highlight(BOOKS_DIR + book_path, section.split('#')[0])
     if soup is None:
         return
-    paragraphs = get_start_and_end_of_highlight(soup, highlight)
-    return paragraphs
+    location = get_highlight_location_from_id(highlight_id, highlight,
+                                              BOOKS_DIR + book_path, soup)
+    return get_sentence_index(soup).sentences(location.start_sentence,
+                                              location.end_sentence + 1)
 
 
 # the function provides more context for a given highlight.
-# it will return `amount_of_sentences` before or after the highlight
+# it will return `amount_of_sentences` before or after the highlight;
+# the soup is only broken into sentences once (see `utils/sentence_index.py`)
 def expand_found_highlight(
     highlight_to_expand: list[str],
-    soup: list[str],
+    soup: str,
     amount_of_sentences: int,
     backwards: bool,
         ) -> list[str]:
     # decide whether to look for first or last sentence of highlight
     anchor = 0 if backwards else -1
-    broken_soup = break_string_into_list_of_sentences(soup)
+    sentence_index = get_sentence_index(soup)
     try: 
-        highlight_location = broken_soup.index(highlight_to_expand[anchor])
-        return (broken_soup[highlight_location - amount_of_sentences:highlight_location]
+        highlight_location = sentence_index.index_of(highlight_to_expand[anchor])
+        return (sentence_index.sentences(highlight_location - amount_of_sentences, highlight_location)
                 if backwards
-                else broken_soup[highlight_location + 1:highlight_location + 1 + amount_of_sentences])
+                else sentence_index.sentences(highlight_location + 1,
+                                              highlight_location + 1 + amount_of_sentences))
     except IndexError:
         return highlight_to_expand
 
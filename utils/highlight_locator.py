@@ -0,0 +1,100 @@
+from collections import deque
+from typing import Iterable, Iterator, Optional
+from utils.sentence_index import SentenceIndex
+
+# below this many distinct fragments, `str.find` (which runs in C)
+# beats walking the automaton character by character in Python
+AUTOMATON_MIN_FRAGMENTS = 8
+
+
+class AhoCorasick:
+    """Aho-Corasick automaton: finds every occurrence
+    of any of the patterns in a single pass over a text."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns = list(patterns)
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.output: list[list[int]] = [[]]
+        for pattern_index, pattern in enumerate(self.patterns):
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                state = next_state
+            self.output[state].append(pattern_index)
+        # breadth-first, so the failure state of a state's parent is already known
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                if self.fail[next_state] == next_state:
+                    self.fail[next_state] = 0
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int]]:
+        """Yields (start offset, pattern index) for every occurrence,
+        in order of where the occurrences end"""
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_index in output[state]:
+                yield position + 1 - len(patterns[pattern_index]), pattern_index
+
+
+def locate_fragments(
+        index: SentenceIndex,
+        fragments: Iterable[str]
+        ) -> dict[str, int]:
+    """For each fragment, the index of the first sentence containing it
+    (what `get_index_of_sentence_in_sentences_list` finds, one at a time);
+    fragments no sentence contains are left out."""
+    pending = set(fragments)
+    located = {}
+    if '' in pending:
+        located[''] = 0
+        pending.discard('')
+
+    def fits_in_a_sentence(start: int, fragment: str) -> Optional[int]:
+        sentence = index.sentence_at(start)
+        if start >= index.starts[sentence] and start + len(fragment) <= index.ends[sentence]:
+            return sentence
+        return None
+
+    if len(pending) < AUTOMATON_MIN_FRAGMENTS:
+        for fragment in pending:
+            start = index.text.find(fragment)
+            while start != -1:
+                sentence = fits_in_a_sentence(start, fragment)
+                if sentence is not None:
+                    located[fragment] = sentence
+                    break
+                start = index.text.find(fragment, start + 1)
+        return located
+
+    automaton = AhoCorasick(pending)
+    remaining = len(pending)
+    for start, pattern_index in automaton.iter_matches(index.text):
+        fragment = automaton.patterns[pattern_index]
+        if fragment in located:
+            continue
+        sentence = fits_in_a_sentence(start, fragment)
+        if sentence is not None:
+            located[fragment] = sentence
+            remaining -= 1
+            if not remaining:
+                break
+    return located
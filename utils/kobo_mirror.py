@@ -0,0 +1,260 @@
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+from utils.const import KOBO_MIRROR_DB_PATH
+from utils.logging import logging
+from utils.sqlite_pool import get_connection_pool
+
+# a local copy of what kobogarden needs from the Kobo database, with one row
+# per book and per highlight and indexes for every lookup the interface makes
+# (the Kobo database can only be searched with `LIKE '%...%'`, which scans).
+# It is kept up to date incrementally (see `sync_mirror`); deleting the file
+# just means the next sync imports everything again.
+MIRROR_SCHEMA_VERSION = 4
+MIRROR_SCHEMA = """
+-- the Kobo database the mirror was last synced from; `watermark` is the
+-- most recent DateCreated/DateModified imported from it, and `synced_at`
+-- when that sync happened (seconds since the epoch, like a file's mtime)
+CREATE TABLE IF NOT EXISTS mirror_source (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    source_path TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    watermark TEXT,
+    synced_at REAL NOT NULL
+);
+
+-- highlights that were on the device once, and have since been deleted
+CREATE TABLE IF NOT EXISTS deleted_highlights (
+    bookmark_id TEXT PRIMARY KEY,
+    volume_id TEXT,
+    deleted_at TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS books (
+    volume_id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    title TEXT,
+    author TEXT,
+    book_id TEXT,
+    last_highlight_date TEXT
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS highlights (
+    bookmark_id TEXT PRIMARY KEY,
+    volume_id TEXT NOT NULL,
+    text TEXT,
+    date_created TEXT,
+    date_modified TEXT,
+    start_container_path TEXT,
+    end_container_path TEXT
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS books_by_filename ON books (filename, volume_id);
+CREATE INDEX IF NOT EXISTS books_by_title ON books (title);
+-- cover the books list and the highlights list of a book, in order,
+-- and the keys their pages are fetched by (see `utils/database.py`)
+CREATE INDEX IF NOT EXISTS books_by_last_highlight
+    ON books (last_highlight_date DESC, volume_id DESC, title, author, filename)
+    WHERE author IS NOT NULL;
+CREATE INDEX IF NOT EXISTS highlights_of_book
+    ON highlights (volume_id, date_created, bookmark_id, text,
+                   start_container_path, end_container_path);
+"""
+
+def _set_up_mirror(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA journal_mode=WAL")
+    if conn.execute("PRAGMA user_version").fetchone()[0] != MIRROR_SCHEMA_VERSION:
+        tables = [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")]
+        conn.execute("BEGIN IMMEDIATE")
+        for table in tables:
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f"PRAGMA user_version = {MIRROR_SCHEMA_VERSION}")
+        conn.execute("COMMIT")
+    conn.executescript(MIRROR_SCHEMA)
+
+
+def borrow_mirror_connection():
+    """`with borrow_mirror_connection() as conn:` borrows a connection to the
+    mirror database from its pool (see `utils/sqlite_pool.py`), as it is;
+    `utils/database.py`'s `mirror_connection` syncs it first."""
+    return get_connection_pool(KOBO_MIRROR_DB_PATH, _set_up_mirror,
+                               pragmas=("synchronous=NORMAL",),
+                               timeout=30, isolation_level=None).connection()
+
+
+def get_source_stamp(kobo_db_path: str) -> str:
+    """Changes whenever the Kobo database file does"""
+    stat = os.stat(kobo_db_path)
+    return f"{stat.st_ino}-{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def get_mirrored_source(conn: sqlite3.Connection) -> Optional[tuple[str, str]]:
+    """(path, stamp) of the Kobo database last synced from, if any"""
+    row = conn.execute("SELECT source_path, stamp FROM mirror_source WHERE id = 0").fetchone()
+    return tuple(row) if row else None
+
+
+def is_newer_than_last_sync(conn: sqlite3.Connection, kobo_db_path: str) -> bool:
+    """Whether the Kobo database at `kobo_db_path` was written after the
+    mirror was last synced (eg. a copy taken since then)"""
+    try:
+        mtime = os.stat(kobo_db_path).st_mtime
+    except FileNotFoundError:
+        return False
+    row = conn.execute("SELECT synced_at FROM mirror_source WHERE id = 0").fetchone()
+    return row is None or mtime > row[0]
+
+
+def take_epub_file_name_from_path(path: str) -> str:
+    return path.split('/')[-1]
+
+
+@dataclass
+class MirrorChanges:
+    """Highlights a sync added or modified, and the ones it found deleted"""
+    changed: list[str] = field(default_factory=list)
+    deleted: list[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.changed or self.deleted)
+
+
+HIGHLIGHT_COLUMNS = ('volume_id', 'text', 'date_created', 'date_modified',
+                     'start_container_path', 'end_container_path')
+
+
+def sync_mirror(
+        conn: sqlite3.Connection,
+        source: sqlite3.Connection,
+        source_path: str,
+        stamp: str
+        ) -> MirrorChanges:
+    """Brings the mirror up to date with the Kobo database (`source`),
+    in one transaction: only Bookmark rows created or modified since the
+    last sync are imported, and highlights no longer in the Kobo database
+    are recorded as deleted. Readers keep seeing the previous state
+    until it's done."""
+    changes = MirrorChanges()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            "SELECT source_path, stamp, watermark FROM mirror_source WHERE id = 0").fetchone()
+        same_source = row is not None and row[0] == os.path.abspath(source_path)
+        # someone else (another thread or process) might have just done it
+        if same_source and row[1] == stamp:
+            conn.execute("COMMIT")
+            return changes
+        # a different database (eg. the device instead of a copy of it)
+        # may be behind the watermark, so everything is compared again
+        watermark = row[2] if same_source else None
+
+        query = """
+            SELECT BookmarkID, VolumeID, Text, DateCreated, DateModified,
+                   StartContainerPath, EndContainerPath
+            FROM "Bookmark"
+        """
+        # `>=`, as more highlights might have been made in the same second;
+        # re-imported rows that didn't change aren't reported as changed
+        if watermark is not None:
+            query += " WHERE DateCreated >= :watermark OR DateModified >= :watermark"
+        touched_volumes = set()
+        for bookmark_id, *columns in source.execute(query, {'watermark': watermark}):
+            # highlights are paginated by date, which can't be NULL
+            columns[2] = columns[2] or ''
+            known = conn.execute(f"""
+                SELECT {', '.join(HIGHLIGHT_COLUMNS)} FROM highlights WHERE bookmark_id = ?
+            """, (bookmark_id,)).fetchone()
+            if known is not None and tuple(known) == tuple(columns):
+                continue
+            conn.execute(f"""
+                INSERT OR REPLACE INTO highlights (bookmark_id, {', '.join(HIGHLIGHT_COLUMNS)})
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (bookmark_id, *columns))
+            conn.execute("DELETE FROM deleted_highlights WHERE bookmark_id = ?", (bookmark_id,))
+            changes.changed.append(bookmark_id)
+            touched_volumes.add(columns[0])
+            if known is not None:
+                touched_volumes.add(known[0])
+            dates = [date for date in (columns[2], columns[3]) if date]
+            if dates and (watermark is None or max(dates) > watermark):
+                watermark = max(dates)
+
+        # deletions can only be told apart by what is missing
+        on_device = {bookmark_id for (bookmark_id,) in
+                     source.execute('SELECT BookmarkID FROM "Bookmark"')}
+        deleted_at = datetime.now().isoformat(timespec='milliseconds')
+        for bookmark_id, volume_id in conn.execute(
+                "SELECT bookmark_id, volume_id FROM highlights").fetchall():
+            if bookmark_id in on_device:
+                continue
+            conn.execute("DELETE FROM highlights WHERE bookmark_id = ?", (bookmark_id,))
+            conn.execute("""
+                INSERT OR REPLACE INTO deleted_highlights (bookmark_id, volume_id, deleted_at)
+                VALUES (?, ?, ?)
+            """, (bookmark_id, volume_id, deleted_at))
+            changes.deleted.append(bookmark_id)
+            touched_volumes.add(volume_id)
+
+        for volume_id in touched_volumes:
+            _sync_book(conn, source, volume_id)
+
+        conn.execute("""
+            INSERT OR REPLACE INTO mirror_source (id, source_path, stamp, watermark, synced_at)
+            VALUES (0, ?, ?, ?, ?)
+        """, (os.path.abspath(source_path), stamp, watermark, time.time()))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if changes:
+        logging.info("Synced the Kobo database mirror: %s highlights changed, %s deleted",
+                     len(changes.changed), len(changes.deleted))
+    return changes
+
+
+def _sync_book(
+        conn: sqlite3.Connection,
+        source: sqlite3.Connection,
+        volume_id: str
+        ) -> None:
+    """Refreshes the book row of `volume_id`, dropping it
+    once it has no highlights left"""
+    last_highlight_date = conn.execute("""
+        SELECT max(date_created) FROM highlights WHERE volume_id = ?
+    """, (volume_id,)).fetchone()[0]
+    book = source.execute("""
+        SELECT Title, Attribution, BookId
+        FROM content
+        WHERE ContentID = ? AND ContentType = 6
+    """, (volume_id,)).fetchone()
+    if last_highlight_date is None or book is None:
+        conn.execute("DELETE FROM books WHERE volume_id = ?", (volume_id,))
+        return
+    conn.execute("""
+        INSERT OR REPLACE INTO books
+        (volume_id, filename, title, author, book_id, last_highlight_date)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, (volume_id, take_epub_file_name_from_path(volume_id), *book, last_highlight_date))
+
+
+def take_snapshot(device_db_path: str, snapshot_path: str) -> None:
+    """Copies the Kobo database with sqlite's online backup API, so the copy
+    is consistent even if the device is writing to it; the previous snapshot
+    is only replaced once the new one is complete."""
+    Path(snapshot_path).parent.mkdir(parents=True, exist_ok=True)
+    partial_path = snapshot_path + '.partial'
+    source = sqlite3.connect(Path(device_db_path).absolute().as_uri() + '?mode=ro', uri=True)
+    try:
+        snapshot = sqlite3.connect(partial_path)
+        try:
+            source.backup(snapshot)
+        finally:
+            snapshot.close()
+    finally:
+        source.close()
+    os.replace(partial_path, snapshot_path)
@@ -0,0 +1,110 @@
+import multiprocessing
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional
+from utils.const import BOOKS_DIR
+from utils.cache_store import (
+    get_highlight_location,
+    put_highlight_location,
+)
+from utils.database import get_highlight_records_of_book
+from utils.epub_cache import get_epub_fingerprint
+from utils.epub_validation import get_full_context_from_highlight
+from utils.highlight_handling import locate_highlights_of_section
+from utils.logging import logging, log_directly_to_file
+from utils.toc_handling import get_chapter_of_highlight
+
+
+@dataclass
+class BookIndexReport:
+    """What happened while indexing one book"""
+    filename: str
+    highlights: int = 0
+    resolved: int = 0
+    already_indexed: int = 0
+    failures: list[tuple[str, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def index_book(filename: str, force: bool = False) -> BookIndexReport:
+    """Resolves context and chapter for every highlight of a book, section
+    by section, and stores them in the cache database. Highlights already
+    resolved for the current version of the epub are skipped (unless `force`),
+    so an interrupted run picks up where it stopped."""
+    started = time.perf_counter()
+    report = BookIndexReport(filename)
+    book_path = BOOKS_DIR + filename
+    try:
+        fingerprint = get_epub_fingerprint(book_path)
+        records = get_highlight_records_of_book(filename)
+    except Exception as e:
+        report.failures.append((filename, f"{type(e).__name__}: {e}"))
+        report.seconds = time.perf_counter() - started
+        return report
+
+    sections = defaultdict(list)
+    for record in records:
+        if not record.text:
+            continue
+        report.highlights += 1
+        known = None if force else get_highlight_location(record.bookmark_id, fingerprint)
+        if known is not None and known.is_located and known.chapter is not None:
+            report.already_indexed += 1
+            continue
+        sections[record.start_container_path.split('#')[0]].append(
+                (record.bookmark_id, record.text.strip(),
+                 record.start_container_path, record.end_container_path or ''))
+
+    for section, section_highlights in sections.items():
+        try:
+            soup = get_full_context_from_highlight(book_path, section)
+            if soup is None:
+                raise FileNotFoundError(f"section {section} could not be read")
+            locations = locate_highlights_of_section(book_path, soup, section_highlights)
+        except Exception as e:
+            logging.error("Could not index section %s of %s", section, filename, exc_info=True)
+            report.failures.extend((highlight_id, f"{type(e).__name__}: {e}")
+                                   for highlight_id, *_ in section_highlights)
+            continue
+        for (highlight_id, _, start_container_path, _), location in zip(section_highlights, locations):
+            if location is None:
+                # what `get_index_of_sentence_in_sentences_list` raises on a miss
+                report.failures.append((highlight_id, "StopIteration: highlight not found in section"))
+                continue
+            # (with `force`, the chapter is cleared, and so resolved again below)
+            put_highlight_location(location, force=force)
+            try:
+                get_chapter_of_highlight(highlight_id, start_container_path, book_path)
+            except Exception as e:
+                report.failures.append((highlight_id, f"chapter: {type(e).__name__}: {e}"))
+                continue
+            report.resolved += 1
+
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def index_library(
+        filenames: list[str],
+        workers: Optional[int] = None,
+        force: bool = False
+        ) -> Iterator[BookIndexReport]:
+    """Indexes books across a process pool, yielding each report as its book is done"""
+    # books whose epub isn't in BOOKS_DIR aren't worth a worker
+    present = []
+    for filename in filenames:
+        if Path(BOOKS_DIR + filename).exists():
+            present.append(filename)
+        else:
+            yield BookIndexReport(filename, failures=[(filename, f"epub not found in {BOOKS_DIR}")])
+    # workers are spawned, not forked: they don't inherit anything from this
+    # process (eg. its open SQLite connections, see `utils/sqlite_pool.py`)
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=log_directly_to_file) as executor:
+        futures = [executor.submit(index_book, filename, force) for filename in present]
+        for future in as_completed(futures):
+            yield future.result()
@@ -1,12 +1,60 @@
+import atexit
 import logging
-import sys
+import logging.handlers
+import os
+import queue
+from utils.const import (
+    LOG_BACKUP_COUNT,
+    LOG_FILE,
+    LOG_LEVEL,
+    LOG_MAX_BYTES,
+)
 
-# Set the basic configuration for the logger
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(funcName)s - %(filename)s:%(lineno)d - %(message)s',
-                    level=logging.DEBUG,
-                    handlers=[
-                        logging.FileHandler('app.log'),  # Log to a file named 'app.log'
-                    ])
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(funcName)s - %(filename)s:%(lineno)d - %(message)s'
+LOG_LEVEL_VARIABLE = 'KOBOGARDEN_LOG_LEVEL'
 
 
+def _file_handler(rotating: bool) -> logging.Handler:
+    handler = (logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT,
+                                                    encoding='utf-8', delay=True)
+               if rotating else logging.FileHandler(LOG_FILE, encoding='utf-8', delay=True))
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return handler
 
+
+# Records are only put on a queue by whoever logs (eg. the interface's
+# thread); a listener thread formats and writes them to the file. Call sites
+# pass their arguments %-style, so nothing is formatted below the level.
+_queue = queue.SimpleQueue()
+_listener = logging.handlers.QueueListener(_queue, _file_handler(rotating=True),
+                                           respect_handler_level=True)
+_listener.start()
+atexit.register(_listener.stop)
+
+_queue_handler = logging.handlers.QueueHandler(_queue)
+# the message only; the listener's handler adds everything else
+_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+
+# (not `basicConfig`, which does nothing if something else,
+# eg. a test runner, already gave the root logger a handler)
+logging.getLogger().addHandler(_queue_handler)
+_level = os.environ.get(LOG_LEVEL_VARIABLE, LOG_LEVEL).upper()
+if _level in logging.getLevelNamesMapping():
+    logging.getLogger().setLevel(_level)
+else:
+    logging.getLogger().setLevel(LOG_LEVEL)
+    logging.warning("%s=%s is not a log level; using %s",
+                    LOG_LEVEL_VARIABLE, os.environ[LOG_LEVEL_VARIABLE], LOG_LEVEL)
+
+
+def log_directly_to_file() -> None:
+    """For processes without the listener thread (forked, or started by
+    a process pool as `initializer`): they append to the file themselves"""
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_file_handler(rotating=False))
+
+
+os.register_at_fork(after_in_child=log_directly_to_file)
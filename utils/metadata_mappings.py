@@ -0,0 +1,96 @@
+import os
+import re
+from pathlib import Path
+from threading import Lock
+from typing import Optional, Tuple
+from utils.const import PAOGARDEN_DIR
+from utils.logging import logging
+
+# the title and author given to a book in the metadata modal,
+# one `original filename|title|author` line per book
+METADATA_MAPPINGS_FILE = "book_metadata_mappings.txt"
+
+
+def clean_filename(filename: str) -> str:
+    """Remove extension and clean up the filename for comparison"""
+    return re.sub(r'[^\w\s-]', '', filename.replace('.epub', '').strip().lower())
+
+
+class MetadataMappingStore:
+    """The mappings file, read once into a dict indexed by cleaned filename;
+    it is only read again if it changes on disk, and written back whole
+    (to a temporary file renamed over it) when a mapping is set."""
+
+    def __init__(self, path: str):
+        # a missing file is read as no mappings, until one is set
+        self.path = Path(path)
+        self._mappings: dict[str, Tuple[str, str, str]] = {}
+        self._stamp = None
+        self._lock = Lock()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _revalidate(self) -> None:
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        mappings = {}
+        if stamp is not None:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        filename, title, author = line.strip().split('|')
+                        mappings[clean_filename(filename)] = (filename, title.strip(), author.strip())
+            logging.info("Refreshed book metadata from file")
+        self._mappings = mappings
+        self._stamp = stamp
+
+    def get(self, original_filename: str) -> Tuple[Optional[str], Optional[str]]:
+        """(title, author) the book was given, or (None, None)"""
+        with self._lock:
+            self._revalidate()
+            mapping = self._mappings.get(clean_filename(original_filename))
+        return (mapping[1], mapping[2]) if mapping else (None, None)
+
+    def set(self, original_filename: str, title: str, author: str) -> None:
+        with self._lock:
+            self._revalidate()
+            # the mapping set last goes last, as it always did
+            self._mappings.pop(clean_filename(original_filename), None)
+            self._mappings[clean_filename(original_filename)] = (original_filename, title, author)
+            partial_path = self.path.with_name('.' + self.path.name + '.partial')
+            with open(partial_path, 'w') as f:
+                f.write(''.join(f"{filename}|{title}|{author}\n"
+                                for filename, title, author in self._mappings.values()))
+            os.replace(partial_path, self.path)
+            self._stamp = self._file_stamp()
+
+
+_stores: dict[str, MetadataMappingStore] = {}
+_stores_lock = Lock()
+
+
+def get_metadata_mapping_store(path: Optional[str] = None) -> MetadataMappingStore:
+    """The one store of a mappings file (by default, the one in PAOGARDEN_DIR)"""
+    path = path or str(Path(PAOGARDEN_DIR) / METADATA_MAPPINGS_FILE)
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = _stores[path] = MetadataMappingStore(path)
+        return store
+
+
+def get_mapped_title_and_author(
+        original_filename: str,
+        title: str,
+        author: str
+        ) -> Tuple[str, str]:
+    """The title and author the book was given, if it was given any"""
+    mapped_title, mapped_author = get_metadata_mapping_store().get(original_filename)
+    return (mapped_title if mapped_title is not None else title,
+            mapped_author if mapped_author is not None else author)
@@ -0,0 +1,69 @@
+import re
+from typing import Optional
+from bs4 import BeautifulSoup, Tag
+
+# Kobo container paths look like `text/part0011.html#point(/1/4/192/3:147)`:
+# the section, then the position of the highlight's start (or end) in it.
+# Each step is a 1-based index into a node's children, counting text nodes
+# too; `/1` is the root element, and the number after `:` is
+# the character offset inside the node the steps lead to.
+POINT_PATH_PATTERN = re.compile(r"^(?P<section>[^#]*)#point\((?P<steps>(?:/\d+)+)(?::(?P<offset>\d+))?\)$")
+
+
+class PointPath:
+    """A parsed Kobo container path"""
+
+    def __init__(self, section: str, steps: list[int], offset: int):
+        self.section = section
+        self.steps = steps
+        self.offset = offset
+
+    def __repr__(self) -> str:
+        steps = ''.join(f'/{step}' for step in self.steps)
+        return f"PointPath({self.section}#point({steps}:{self.offset}))"
+
+
+def parse_point_path(container_path: str) -> Optional[PointPath]:
+    """`text/part0011.html#point(/1/4/192/3:147)` ->
+    PointPath('text/part0011.html', [1, 4, 192, 3], 147);
+    None if the path doesn't carry a point"""
+    match = POINT_PATH_PATTERN.match(container_path or '')
+    if match is None:
+        return None
+    steps = [int(step) for step in match['steps'].split('/')[1:]]
+    return PointPath(match['section'], steps, int(match['offset'] or 0))
+
+
+def _counts_as_text(string, text_types) -> bool:
+    # the same strings `get_text` joins (eg. no comments or <style> contents)
+    if isinstance(text_types, type):
+        return type(string) is text_types
+    return type(string) in text_types
+
+
+def resolve_point_in_dom(dom: BeautifulSoup, point: PointPath) -> Optional[int]:
+    """Character offset of `point` into the text extracted from `dom`
+    (`(dom.body or dom).get_text()`, as in `get_full_context_from_highlight`),
+    or None if the steps don't lead anywhere in this document."""
+    node = next((child for child in dom.contents if isinstance(child, Tag)), None)
+    if node is None or not point.steps or point.steps[0] != 1:
+        return None
+    for step in point.steps[1:]:
+        if not isinstance(node, Tag) or not 1 <= step <= len(node.contents):
+            return None
+        node = node.contents[step - 1]
+
+    scope = dom.body or dom
+    text_types = scope.interesting_string_types
+    offset = 0
+    for descendant in scope.descendants:
+        if descendant is node:
+            break
+        if isinstance(descendant, str) and _counts_as_text(descendant, text_types):
+            offset += len(descendant)
+    else:
+        # the point is outside of the body
+        return None
+    if isinstance(node, str):
+        offset += min(point.offset, len(node)) if _counts_as_text(node, text_types) else 0
+    return offset
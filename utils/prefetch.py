@@ -0,0 +1,79 @@
+import threading
+from collections import deque
+from typing import Callable, Hashable
+from utils.const import BOOKS_DIR, PREFETCH_QUEUE_MAX
+from utils.logging import logging
+
+
+class Prefetcher:
+    """Runs warm-up tasks one at a time on a background thread, filling the
+    caches the next screen will read from. The queue is bounded (the oldest
+    requests are dropped first), tasks already queued aren't queued again,
+    and `cancel` drops everything still waiting (a task that has already
+    started runs to the end; its results are only cached, so nothing is lost)."""
+
+    def __init__(self, max_queued: int = PREFETCH_QUEUE_MAX):
+        self._queue: deque[tuple[Hashable, Callable, tuple]] = deque(maxlen=max_queued)
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def submit(self, key: Hashable, task: Callable, *args) -> None:
+        with self._condition:
+            if any(queued_key == key for queued_key, _, _ in self._queue):
+                return
+            self._queue.append((key, task, args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='prefetch', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def cancel(self) -> None:
+        with self._condition:
+            self._queue.clear()
+
+    def pending(self) -> list[Hashable]:
+        with self._condition:
+            return [key for key, _, _ in self._queue]
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                key, task, args = self._queue.popleft()
+            try:
+                task(*args)
+            except Exception as e:
+                # the screen will run into (and report) the same error
+                logging.debug("Prefetching %s failed: %s", key, e)
+
+
+def warm_book(filename: str) -> None:
+    """What opening a book reads: its first page of highlights, their
+    chapters and the book's chapter index"""
+    # imported here (and below) so the main screen doesn't load
+    # the epub parsers before its first frame
+    from utils.database import get_page_of_highlight_records
+    from utils.toc_handling import get_chapter_index, get_chapter_of_highlight
+    book_path = BOOKS_DIR + filename
+    get_chapter_index(book_path)
+    for record in get_page_of_highlight_records(filename):
+        if record.text:
+            get_chapter_of_highlight(record.bookmark_id, record.start_container_path, book_path)
+
+
+def warm_highlight(highlight_id: str) -> None:
+    """What opening a highlight reads: its section's text, where the
+    highlight is in it, and its chapter"""
+    from utils.database import get_highlight_record
+    from utils.highlight_handling import get_highlight_context_from_id
+    from utils.toc_handling import get_chapter_of_highlight
+    record = get_highlight_record(highlight_id)
+    if record is None or not record.text:
+        return
+    get_chapter_of_highlight(highlight_id, record.start_container_path,
+                             BOOKS_DIR + record.filename)
+    get_highlight_context_from_id(highlight_id)
+
+
+prefetcher = Prefetcher()
@@ -1,82 +1,89 @@
-from zipfile import ZipFile
-import xml.etree.ElementTree as ET
+import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
 from utils.const import IMAGE_FILES_PATH
+from utils.epub_reader import get_epub_reader
 from utils.logging import logging
-from typing import Optional
+from typing import Iterator, Optional
+
+# covers of books whose tiddler is being created are extracted here,
+# one at a time, so creating the tiddler doesn't wait for it
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix='covers')
+
+
+def get_cover_filename(epub_path: str, book_name: str) -> Optional[str]:
+    """The filename (in IMAGE_FILES_PATH) the book's cover is extracted to,
+    or None if the epub has no cover; only the epub's OPF is read."""
+    cover_href = get_epub_reader(epub_path).cover_href
+    if cover_href is None:
+        return None
+    cover_ext = Path(cover_href).suffix.lower()[1:]  # Remove the dot
+    parsed_book_name = book_name.replace(" ", "-").lower()
+    return f"book-cover-{parsed_book_name}.{cover_ext}"
+
 
 def extract_cover_from_epub(epub_path: str, book_name: str) -> Optional[str]:
     """
     Extract cover image from epub file and save it to images directory.
     Returns the filename of the saved cover if successful, None otherwise.
+    A cover already extracted since the epub last changed is kept as it is.
     """
-    logging.debug(f"Extracting cover from epub: {epub_path}")
+    logging.debug("Extracting cover from epub: %s", epub_path)
+    try:
+        reader = get_epub_reader(epub_path)
+        new_cover_filename = get_cover_filename(epub_path, book_name)
+        if new_cover_filename is None:
+            return None
+        member = reader.manifest[reader.cover_href]
+
+        cover_path = Path(IMAGE_FILES_PATH) / new_cover_filename
+        try:
+            stat = cover_path.stat()
+            if (stat.st_size == reader.sizes.get(member)
+                    and stat.st_mtime_ns >= os.stat(epub_path).st_mtime_ns):
+                logging.debug("Cover image is up to date: %s", cover_path)
+                return new_cover_filename
+        except FileNotFoundError:
+            pass
+
+        # Save cover to images directory, streamed from the zip
+        # (and renamed into place once complete)
+        partial_path = cover_path.with_name('.' + cover_path.name + '.partial')
+        with reader.open_member(member) as cover_data, open(partial_path, 'wb') as file:
+            shutil.copyfileobj(cover_data, file)
+        os.replace(partial_path, cover_path)
+
+        logging.info("Extracted cover image to: %s", cover_path)
+        return new_cover_filename
+
+    except Exception as e:
+        logging.error("Failed to extract cover from epub: %s", e)
+        return None
+
+
+def extract_cover_in_background(epub_path: str, book_name: str) -> Optional[str]:
+    """Queues the cover's extraction, and returns the filename
+    it will have (see `get_cover_filename`) right away"""
     try:
-        with ZipFile(epub_path, 'r') as epub:
-            # First try to find cover in the OPF file
-            opf_files = [f for f in epub.namelist() if f.endswith('.opf')]
-            if not opf_files:
-                return None
-                
-            # Get OPF directory to resolve relative paths
-            opf_dir = str(Path(opf_files[0]).parent)
-                
-            # Parse OPF to find cover image path
-            opf_content = epub.read(opf_files[0])
-            root = ET.fromstring(opf_content)
-            
-            # Look for cover image in metadata
-            ns = {'opf': 'http://www.idpf.org/2007/opf'}
-            cover_id = None
-            for meta in root.findall('.//opf:meta[@name="cover"]', ns):
-                cover_id = meta.get('content')
-                break
-                
-            if cover_id:
-                # Find the actual image file
-                for item in root.findall('.//opf:item', ns):
-                    if item.get('id') == cover_id:
-                        cover_path = item.get('href')
-                        # Resolve relative path
-                        if opf_dir:
-                            cover_path = str(Path(opf_dir) / cover_path)
-                        break
-            else:
-                # Fallback: look for likely cover image files
-                cover_path = next(
-                    (f for f in epub.namelist() 
-                     if 'cover' in f.lower() and f.endswith(('.jpg', '.jpeg', '.png'))),
-                    None
-                )
-            
-            if not cover_path:
-                return None
-                
-            logging.debug(f"Attempting to extract cover from path: {cover_path}")
-            
-            try:
-                # Extract cover image
-                cover_data = epub.read(cover_path)
-            except KeyError:
-                # If that fails, try without the opf directory
-                base_cover_path = Path(cover_path).name
-                logging.debug(f"Retrying with base path: {base_cover_path}")
-                cover_data = epub.read(base_cover_path)
-            
-            cover_ext = Path(cover_path).suffix.lower()[1:]  # Remove the dot
-            
-            # Create new filename for the cover
-            parsed_book_name = book_name.replace(" ", "-").lower()
-            new_cover_filename = f"book-cover-{parsed_book_name}.{cover_ext}"
-            
-            # Save cover to images directory
-            cover_path = Path(IMAGE_FILES_PATH) / new_cover_filename
-            cover_path.write_bytes(cover_data)
-            
-            logging.info(f"Extracted cover image to: {cover_path}")
-            return new_cover_filename
-            
+        cover_filename = get_cover_filename(epub_path, book_name)
     except Exception as e:
-        logging.error(f"Failed to extract cover from epub: {e}")
-        logging.debug("Available files in epub:", epub.namelist())
-        return None
\ No newline at end of file
+        logging.error("Failed to read cover from epub: %s", e)
+        return None
+    if cover_filename is not None:
+        _background.submit(extract_cover_from_epub, epub_path, book_name)
+    return cover_filename
+
+
+def extract_covers(
+        books: list[tuple[str, str]],
+        workers: Optional[int] = None
+        ) -> Iterator[tuple[str, Optional[str]]]:
+    """Extracts the covers of (epub path, book name) books across a thread
+    pool, yielding (book name, cover filename or None) as each is done"""
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures: dict[Future, str] = {
+                executor.submit(extract_cover_from_epub, epub_path, book_name): book_name
+                for epub_path, book_name in books}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
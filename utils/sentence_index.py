@@ -0,0 +1,108 @@
+import re
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from threading import Lock
+
+# pattern to break a string (soup or highlight) into a list of sentences,
+# using the period ('.') and other punctiation as delimiter.
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s*(?=•|\w)")
+
+# sentence indexes of the most recently used sections
+SENTENCE_INDEXES_MAX = 16
+
+
+class SentenceIndex:
+    """The sentences of a section's text, stored as two arrays of
+    start and end offsets into the text (the same sentences
+    `SENTENCE_BOUNDARY.split` would give). Built once per section,
+    so moving around a highlight is index arithmetic."""
+
+    def __init__(self, text: str, starts: array, ends: array):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        self._first_index_of = None
+        self._sentences = None
+
+    @classmethod
+    def from_text(cls, text: str) -> 'SentenceIndex':
+        starts, ends = array('I'), array('I')
+        previous_end = 0
+        for boundary in SENTENCE_BOUNDARY.finditer(text):
+            starts.append(previous_end)
+            ends.append(boundary.start())
+            previous_end = boundary.end()
+        starts.append(previous_end)
+        ends.append(len(text))
+        return cls(text, starts, ends)
+
+    @classmethod
+    def from_bytes(cls, text: str, offsets: bytes) -> 'SentenceIndex':
+        """Inverse of `to_bytes`"""
+        both = array('I')
+        both.frombytes(offsets)
+        half = len(both) // 2
+        return cls(text, both[:half], both[half:])
+
+    def to_bytes(self) -> bytes:
+        return self.starts.tobytes() + self.ends.tobytes()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def sentence(self, i: int) -> str:
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def sentences(self, start: int, stop: int) -> list[str]:
+        """Same as slicing the list of sentences with [start:stop]"""
+        return [self.sentence(i) for i in range(len(self))[start:stop]]
+
+    def as_list(self) -> list[str]:
+        if self._sentences is None:
+            self._sentences = self.sentences(0, len(self))
+        return self._sentences
+
+    def index_of(self, sentence: str) -> int:
+        """Same as `list.index` over the sentences
+        (raises ValueError if missing), but O(1)"""
+        if self._first_index_of is None:
+            first_index_of = {}
+            for i in range(len(self)):
+                first_index_of.setdefault(self.sentence(i), i)
+            self._first_index_of = first_index_of
+        try:
+            return self._first_index_of[sentence]
+        except KeyError:
+            raise ValueError(f"{sentence!r} is not a sentence of this text")
+
+    def sentence_at(self, offset: int) -> int:
+        """Index of the sentence starting at or before `offset`"""
+        return max(bisect_right(self.starts, offset) - 1, 0)
+
+
+_indexes: OrderedDict[str, SentenceIndex] = OrderedDict()
+_indexes_lock = Lock()
+
+
+def remember_sentence_index(index: SentenceIndex) -> None:
+    """Makes `index` the one `get_sentence_index` returns for its text
+    (eg. when it was loaded from the cache database)"""
+    with _indexes_lock:
+        _indexes[index.text] = index
+        _indexes.move_to_end(index.text)
+        while len(_indexes) > SENTENCE_INDEXES_MAX:
+            _indexes.popitem(last=False)
+
+
+def get_sentence_index(text: str) -> SentenceIndex:
+    """Sentence index of `text`, only segmented the first time
+    (the text's hash is cached by Python, so lookups are cheap)"""
+    with _indexes_lock:
+        index = _indexes.get(text)
+        if index is not None:
+            _indexes.move_to_end(text)
+            return index
+    index = SentenceIndex.from_text(text)
+    remember_sentence_index(index)
+    return index
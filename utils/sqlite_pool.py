@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from queue import Empty, LifoQueue
+from typing import Callable, Iterator
+from utils.const import LOCAL_DB_CONNECTIONS_MAX
+
+
+class SQLiteConnectionPool:
+    """Connections to one of kobogarden's own databases (the cache, the Kobo
+    mirror, the tiddler state), kept open between uses and handed out to one
+    thread at a time, like `KoboConnectionPool` does for the Kobo database.
+    `setup` (the schema, and whatever else is kept in the file) only runs
+    for the first connection of the process; `pragmas` run for every one."""
+
+    def __init__(self, path: str,
+                 setup: Callable[[sqlite3.Connection], None],
+                 pragmas: tuple[str, ...] = (),
+                 max_idle: int = LOCAL_DB_CONNECTIONS_MAX,
+                 **connect_args):
+        self.path = path
+        self.setup = setup
+        self.pragmas = pragmas
+        self.max_idle = max_idle
+        self.connect_args = connect_args
+        self._idle = LifoQueue()
+        self._lock = threading.Lock()
+        self._set_up = False
+        self._pid = os.getpid()
+
+    def _connect(self) -> sqlite3.Connection:
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, **self.connect_args)
+        for pragma in self.pragmas:
+            conn.execute(f"PRAGMA {pragma}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked process can't use (or even close) its parent's connections
+                self._idle = LifoQueue()
+                self._pid = os.getpid()
+            try:
+                return self._idle.get_nowait()
+            except Empty:
+                pass
+            if not self._set_up:
+                conn = self._connect()
+                try:
+                    self.setup(conn)
+                except BaseException:
+                    conn.close()
+                    raise
+                self._set_up = True
+                return conn
+        return self._connect()
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and self._idle.qsize() < self.max_idle:
+                self._idle.put(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except Empty:
+                    return
+
+
+_pools: dict[str, SQLiteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(path: str, setup: Callable[[sqlite3.Connection], None],
+                        **pool_args) -> SQLiteConnectionPool:
+    """The one pool of the database at `path`, created on first use"""
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = SQLiteConnectionPool(path, setup, **pool_args)
+        return pool
+
+
+def close_connection_pools() -> None:
+    """Closes every idle connection and forgets the pools
+    (so the next connection to each database sets it up again)"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,80 @@
+import re
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from utils.const import STARTUP_BUDGET_SECONDS
+
+# the checkout being measured (rather than PROJECT_DIR), so changes can be
+# measured before they are deployed
+CHECKOUT_DIR = Path(__file__).resolve().parent.parent
+
+# started in a fresh interpreter for every run, so nothing is already imported;
+# prints the wall clock time once the first frame has been displayed
+FIRST_FRAME_SCRIPT = """
+import sys, time
+from interface.main_screen import MainScreen
+
+class FirstFrame(MainScreen):
+    def on_ready(self) -> None:
+        print(time.time(), file=sys.__stdout__, flush=True)
+        self.exit()
+
+FirstFrame().run(headless=True)
+"""
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+@dataclass
+class StartupReport:
+    """How long kobogarden takes to start, over a number of cold starts"""
+    first_frame_seconds: list[float] = field(default_factory=list)
+    import_seconds: float = 0.0
+    # (module, seconds spent importing it, not counting what it imports)
+    heaviest_imports: list[tuple[str, float]] = field(default_factory=list)
+
+    @property
+    def median_first_frame(self) -> float:
+        return statistics.median(self.first_frame_seconds)
+
+    def within_budget(self, budget: float = STARTUP_BUDGET_SECONDS) -> bool:
+        return self.median_first_frame <= budget
+
+
+def measure_import_time(module: str = 'interface.main_screen', top: int = 10
+                        ) -> tuple[float, list[tuple[str, float]]]:
+    """Total time `python -X importtime` reports for importing `module`,
+    and the modules that took longest by themselves"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=CHECKOUT_DIR, capture_output=True, text=True, check=True)
+    total, modules = 0, []
+    for self_us, cumulative_us, indent, name in IMPORT_TIME_LINE.findall(result.stderr):
+        # top level imports are indented by a single space
+        if len(indent) == 1:
+            total += int(cumulative_us)
+        modules.append((name, int(self_us) / 1e6))
+    modules.sort(key=lambda module: module[1], reverse=True)
+    return total / 1e6, modules[:top]
+
+
+def measure_first_frame() -> float:
+    """Seconds from launching a new interpreter to the main
+    screen's first frame (run headless)"""
+    started = time.time()
+    result = subprocess.run([sys.executable, '-c', FIRST_FRAME_SCRIPT],
+                            cwd=CHECKOUT_DIR, capture_output=True, text=True)
+    # textual reports errors (eg. a missing stylesheet) on its own, and exits
+    if not result.stdout.strip():
+        raise RuntimeError(f"kobogarden did not start:\n{result.stderr[-2000:]}")
+    return float(result.stdout.split()[0]) - started
+
+
+def run_startup_benchmark(runs: int = 5) -> StartupReport:
+    report = StartupReport()
+    report.import_seconds, report.heaviest_imports = measure_import_time()
+    for _ in range(runs):
+        report.first_frame_seconds.append(measure_first_frame())
+    return report
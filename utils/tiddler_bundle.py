@@ -0,0 +1,63 @@
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+from utils.logging import logging
+
+
+def get_tiddler_fields(tiddler_content: str) -> dict[str, str]:
+    """The fields of a tiddler in `.tid` format (as the `produce_*_tiddler_string`
+    functions write them): a header of `field: value` lines, a blank line,
+    and the text"""
+    header, _, text = tiddler_content.partition('\n\n')
+    fields = {}
+    for line in header.splitlines():
+        name, separator, value = line.partition(':')
+        if separator:
+            fields[name.strip()] = value.strip()
+    fields['text'] = text
+    return fields
+
+
+class JsonBundleSink:
+    """Streams tiddlers into a single JSON file, in the format TiddlyWiki
+    imports (by dragging the file onto the wiki): one object of fields per
+    tiddler. Each tiddler is written as soon as it's given, so memory doesn't
+    grow with the bundle; the file only appears once it's complete.
+
+    It can be given to `export_book` instead of writing `.tid` files:
+
+        with JsonBundleSink('quotes.json') as sink:
+            export_book(filename, sink=sink.write)
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.partial_path = self.path.with_name('.' + self.path.name + '.partial')
+        self.count = 0
+        self._file = None
+
+    def __enter__(self) -> 'JsonBundleSink':
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.partial_path, 'w', encoding='utf-8')
+        self._file.write('[')
+        return self
+
+    def write(self, tiddlers: list[Tuple[str, str]], workers: Optional[int] = None) -> None:
+        """Adds (title, `.tid` content) tiddlers to the bundle; `workers` is
+        only there to be called like `write_tiddlers`"""
+        for title, content in tiddlers:
+            fields = get_tiddler_fields(content)
+            fields['title'] = title
+            self._file.write(',\n' if self.count else '\n')
+            json.dump(fields, self._file, ensure_ascii=False)
+            self.count += 1
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._file.write('\n]\n')
+        self._file.close()
+        if exc_type is None:
+            os.replace(self.partial_path, self.path)
+            logging.info("Wrote %s tiddlers to %s", self.count, self.path)
+        else:
+            self.partial_path.unlink(missing_ok=True)
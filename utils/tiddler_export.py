@@ -0,0 +1,174 @@
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from utils.const import (
+        BOOKS_DIR,
+        TIDDLERS_PATH,
+        AUTO_TITLE_WORDS
+        )
+from utils.database import HighlightRecord, get_highlight_records_of_book
+from utils.highlight_handling import get_highlight_context_from_id
+from utils.logging import logging
+from utils.tiddler_handling import (
+        TiddlerFilenameManager,
+        add_highlight_ids_to_record,
+        check_tiddler_exists,
+        get_book_tiddler_highlight_number,
+        produce_book_tiddlers,
+        produce_highlight_tiddler_string,
+        record_in_highlight_id,
+        set_book_tiddler_highlight_number,
+        write_tiddlers,
+        )
+from utils.tiddler_state import mark_book_tiddler_updated, take_quote_orders
+from utils.toc_handling import get_chapter_of_highlight
+
+# characters TiddlyWiki doesn't allow in titles (or that can't be in a filename)
+UNSAFE_TITLE_CHARACTERS = re.compile(r'[\[\]{}|#/\\]')
+
+
+@dataclass
+class BookExportReport:
+    """What happened while exporting one book's highlights"""
+    filename: str
+    book_title: str = ''
+    exported: list[str] = field(default_factory=list)
+    already_exported: int = 0
+    failures: list[tuple[str, str]] = field(default_factory=list)
+    seconds: float = 0.0
+
+
+def auto_title(highlight: str, taken: set[str]) -> str:
+    """A title from the first words of the highlight,
+    numbered if it's already taken (by a tiddler, or one in `taken`)"""
+    words = UNSAFE_TITLE_CHARACTERS.sub('', highlight).split()
+    title = ' '.join(words[:AUTO_TITLE_WORDS]).strip(' .,;:!?-') or 'highlight'
+    if len(words) > AUTO_TITLE_WORDS:
+        title += '...'
+    candidate, number = title, 1
+    while candidate in taken or check_tiddler_exists(candidate):
+        number += 1
+        candidate = f"{title} ({number})"
+    taken.add(candidate)
+    return candidate
+
+
+def get_book_title_and_author(record: HighlightRecord) -> tuple[str, str]:
+    """As the book highlights screen shows them: the metadata mapping,
+    if there is one for the book, or else what the Kobo database has"""
+    mapped_title, mapped_author = TiddlerFilenameManager().get_mapped_metadata(record.filename)
+    return (mapped_title if mapped_title is not None else record.title,
+            mapped_author if mapped_author is not None else record.author)
+
+
+def get_quote_of_highlight(record: HighlightRecord) -> str:
+    """The sentences the highlight is in (what the single highlight
+    screen starts with), or the highlight itself if it can't be found"""
+    try:
+        sentences = get_highlight_context_from_id(record.bookmark_id)
+    except Exception as e:
+        logging.debug("No context for %s, using the highlight: %s", record.bookmark_id, e)
+        sentences = None
+    return ' '.join(sentences).strip() if sentences else record.text.strip()
+
+
+# given (title, `.tid` content) tiddlers, puts them somewhere: by default
+# `write_tiddlers`, or eg. `JsonBundleSink.write` (see `utils/tiddler_bundle.py`)
+TiddlerSink = Callable[[list[tuple[str, str]], Optional[int]], None]
+
+
+def export_book(
+        filename: str,
+        tags: Optional[list[str]] = None,
+        workers: Optional[int] = None,
+        sink: TiddlerSink = write_tiddlers,
+        taken: Optional[set[str]] = None
+        ) -> BookExportReport:
+    """Turns every highlight of a book that isn't a tiddler yet into one,
+    titled automatically. All tiddlers are built in memory first, and then
+    written at once; the quote orders are taken, and the ids record and the
+    book tiddler's `nbr_of_highlights` written, once for the whole book.
+    Titles in `taken` aren't used (and the ones used are added to it)."""
+    started = time.perf_counter()
+    report = BookExportReport(filename)
+    records = [record for record in get_highlight_records_of_book(filename) if record.text]
+    pending = []
+    for record in records:
+        if record_in_highlight_id(record.bookmark_id):
+            report.already_exported += 1
+        else:
+            pending.append(record)
+    if not pending:
+        report.seconds = time.perf_counter() - started
+        return report
+
+    book_title, book_author = get_book_title_and_author(pending[0])
+    report.book_title = book_title
+    book_path = BOOKS_DIR + filename
+    quotes = []
+    for record in pending:
+        try:
+            quote = get_quote_of_highlight(record)
+            chapter = get_chapter_of_highlight(
+                    record.bookmark_id, record.start_container_path, book_path) or ""
+        except Exception as e:
+            logging.error("Could not export %s", record.bookmark_id, exc_info=True)
+            report.failures.append((record.bookmark_id, f"{type(e).__name__}: {e}"))
+            continue
+        quotes.append((record, quote, chapter))
+
+    if quotes:
+        # the book tiddler is read before taking the orders, as the
+        # counter may have to start from its `nbr_of_highlights`
+        if check_tiddler_exists(book_title):
+            with open(TIDDLERS_PATH + book_title + '.tid', 'r') as file:
+                book_tiddlers = [(book_title, file.read())]
+            highlight_count = get_book_tiddler_highlight_number(book_tiddlers[0][1])
+        else:
+            book_tiddlers = produce_book_tiddlers(book_title, book_author, filename)
+            highlight_count = 0
+        orders = take_quote_orders(book_title, len(quotes), lambda: highlight_count)
+        taken = set() if taken is None else taken
+        taken.update((book_title, 'fhl-' + book_title))
+        tiddlers = []
+        for (record, quote, chapter), quote_order in zip(quotes, orders):
+            title = auto_title(quote, taken)
+            tiddlers.append((title, produce_highlight_tiddler_string(
+                created_timestamp=datetime.now().strftime("%Y%m%d%H%M%S%f")[:-3],
+                tags=list(tags or []),
+                highlight_title=title,
+                comment="",
+                highlight=quote,
+                quote_order=quote_order,
+                chapter=chapter,
+            )))
+            report.exported.append(title)
+        _, book_content = book_tiddlers[0]
+        book_tiddlers[0] = (book_title, set_book_tiddler_highlight_number(book_content, orders[-1]))
+
+        sink(tiddlers + book_tiddlers, workers)
+        add_highlight_ids_to_record([record.bookmark_id for record, _, _ in quotes])
+        mark_book_tiddler_updated(book_title, orders[-1])
+        logging.info("Exported %s highlights of %s", len(quotes), book_title)
+    report.seconds = time.perf_counter() - started
+    return report
+
+
+def export_library(
+        filenames: list[str],
+        tags: Optional[list[str]] = None,
+        workers: Optional[int] = None,
+        sink: TiddlerSink = write_tiddlers
+        ) -> Iterator[BookExportReport]:
+    """Exports books one after the other (each one's tiddlers are
+    written from a thread pool), yielding each report as its book is done"""
+    # no two books' quotes get the same title, even before they are in the wiki
+    taken = set()
+    for filename in filenames:
+        try:
+            yield export_book(filename, tags=tags, workers=workers, sink=sink, taken=taken)
+        except Exception as e:
+            logging.error("Could not export %s", filename, exc_info=True)
+            yield BookExportReport(filename, failures=[(filename, f"{type(e).__name__}: {e}")])
@@ -1,4 +1,4 @@
-from os import listdir
+import os
 from datetime import datetime
 from utils.const import (
     BOOKS_DIR,
@@ -6,18 +6,22 @@ from utils.const import (
     TIDDLERS_PATH,
     EXISTING_IDS_FILE
         )
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-import re
+from threading import Lock
 from typing import Optional, Tuple
 from utils.logging import logging
-from utils.retrieve_cover_from_epub import extract_cover_from_epub
-
-try:
-    import pyperclip
-    HAS_CLIPBOARD = True
-except ImportError:
-    HAS_CLIPBOARD = False
-    print("Warning: pyperclip not installed. Clipboard functionality will be disabled.")
+from utils.metadata_mappings import (
+    METADATA_MAPPINGS_FILE,
+    clean_filename,
+    get_metadata_mapping_store,
+)
+from utils.retrieve_cover_from_epub import extract_cover_in_background
+from utils.tiddler_state import (
+    get_stale_book_tiddlers,
+    mark_book_tiddler_updated,
+    take_quote_orders,
+)
 
 
 def produce_fhl_tiddler_string(
@@ -80,38 +84,121 @@ type: text/vnd.tiddlywiki
 </div>
 """
 
+class TiddlerDirectoryIndex:
+    """The titles of the `.tid` files in the tiddlers folder, scanned once
+    and kept as a set; the folder is only scanned again when its mtime
+    changes (ie. a file was added, removed or renamed by someone else).
+    Tiddlers written through `write` are added without a rescan."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._titles: set[str] = set()
+        self._stamp = None
+        self._lock = Lock()
+
+    def _directory_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _revalidate(self) -> None:
+        stamp = self._directory_stamp()
+        if stamp == self._stamp:
+            return
+        if stamp is None:
+            logging.warning("Tiddlers folder %s not found", self.path)
+            self._titles = set()
+        else:
+            with os.scandir(self.path) as entries:
+                self._titles = {entry.name[:-len('.tid')] for entry in entries
+                                if entry.name.endswith('.tid')}
+        self._stamp = stamp
+
+    def __contains__(self, tiddler_title: str) -> bool:
+        with self._lock:
+            self._revalidate()
+            return tiddler_title in self._titles
+
+    def _write_file(self, tiddler_title: str, content: str) -> None:
+        # written next to it and renamed, so TiddlyWiki (or a crash)
+        # never sees a half written tiddler
+        path = Path(self.path) / (tiddler_title + '.tid')
+        partial_path = path.with_name('.' + path.name + '.partial')
+        with open(partial_path, 'w') as file:
+            file.write(content)
+        os.replace(partial_path, path)
+
+    def write(self, tiddler_title: str, content: str) -> None:
+        """Writes (or overwrites) a tiddler's file"""
+        self.write_many([(tiddler_title, content)])
+
+    def write_many(
+            self,
+            tiddlers: list[Tuple[str, str]],
+            workers: Optional[int] = None
+            ) -> None:
+        """Writes (or overwrites) the files of (title, content) tiddlers,
+        from a thread pool when there are several"""
+        with self._lock:
+            # whatever changed before our own writes is picked up first
+            self._revalidate()
+            try:
+                if len(tiddlers) == 1:
+                    self._write_file(*tiddlers[0])
+                else:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        # `list` so the first error (if any) is raised
+                        list(executor.map(lambda tiddler: self._write_file(*tiddler), tiddlers))
+            finally:
+                self._titles.update(title for title, _ in tiddlers
+                                    if os.path.exists(Path(self.path) / (title + '.tid')))
+                self._stamp = self._directory_stamp()
+
+
+tiddler_directory_index = TiddlerDirectoryIndex(TIDDLERS_PATH)
+
+
 def check_tiddler_exists(tiddler_title: str) -> bool:
     """Check if a tiddler with the given title exists"""
-    return (tiddler_title + '.tid') in listdir(TIDDLERS_PATH)
+    return tiddler_title in tiddler_directory_index
+
+
+def write_tiddlers(tiddlers: list[Tuple[str, str]], workers: Optional[int] = None) -> None:
+    """Writes (title, content) tiddlers at once (see `TiddlerDirectoryIndex.write_many`)"""
+    tiddler_directory_index.write_many(tiddlers, workers=workers)
 
 
 def copy_to_clipboard(text: str) -> None:
     """Copy text to clipboard if pyperclip is available"""
-    if HAS_CLIPBOARD:
-        try:
-            pyperclip.copy(text)
-            logging.info(f"Copied to clipboard: {text}")
-        except Exception as e:
-            logging.error(f"Failed to copy to clipboard: {e}")
+    # imported on first use, so it doesn't slow down startup
+    try:
+        import pyperclip
+    except ImportError:
+        logging.warning("pyperclip not installed; clipboard functionality is disabled")
+        return
+    try:
+        pyperclip.copy(text)
+        logging.info("Copied to clipboard: %s", text)
+    except Exception as e:
+        logging.error("Failed to copy to clipboard: %s", e)
 
 
-def create_book_tiddler(
+def produce_book_tiddlers(
         book_title: str,
         book_author: str,
         book_filepath: str
-        ) -> None:
-    if check_tiddler_exists(book_title):
-        logging.warning(f"Warning: Tiddler '{book_title}' already exists!")
-        return
-    
-    # Try to extract cover image
+        ) -> list[Tuple[str, str]]:
+    """(title, content) of the book tiddler and its fhl tiddler;
+    the cover is extracted from the epub (in the background), if it can be found"""
     epub_path = Path(BOOKS_DIR) / book_filepath
     cover_tiddler = None
     if epub_path.exists():
-        cover_tiddler = extract_cover_from_epub(str(epub_path), book_title)
+        cover_tiddler = extract_cover_in_background(str(epub_path), book_title)
     else:
-        logging.debug(f"epub path {epub_path} wasn't found!")
-        
+        logging.debug("epub path %s wasn't found!", epub_path)
+
     formatted_now = datetime.now().strftime("%Y%m%d%H%M%S%f")[:-3]
     book_content = produce_book_tiddler_string(
         formatted_now,
@@ -120,34 +207,72 @@ def create_book_tiddler(
         cover_tiddler
     )
     fhl_content = produce_fhl_tiddler_string(formatted_now, book_title)
+    return [(book_title, book_content), ('fhl-' + book_title, fhl_content)]
 
-    with open(TIDDLERS_PATH + book_title + '.tid', 'w') as file:
-        file.write(book_content)
-    logging.info("Created book tiddler: " + book_title)
+
+def create_book_tiddler(
+        book_title: str,
+        book_author: str,
+        book_filepath: str
+        ) -> None:
+    if check_tiddler_exists(book_title):
+        logging.warning("Warning: Tiddler '%s' already exists!", book_title)
+        return
+
+    (_, book_content), (fhl_title, fhl_content) = produce_book_tiddlers(
+            book_title, book_author, book_filepath)
+
+    tiddler_directory_index.write(book_title, book_content)
+    logging.info("Created book tiddler: %s", book_title)
     copy_to_clipboard(book_title)
-    
-    with open(TIDDLERS_PATH + 'fhl-' + book_title + '.tid', 'w') as file:
-        file.write(fhl_content)
-    logging.info("Created fhl tiddler: " + book_title)
 
+    tiddler_directory_index.write(fhl_title, fhl_content)
+    logging.info("Created fhl tiddler: %s", book_title)
 
-def increment_book_tiddler_highlight_number(book_title: str) -> int:
-    """The function increments the book tiddler highlight number,
-    but also returns the number of highlights"""
-    with open(TIDDLERS_PATH + book_title + '.tid', 'r') as file:
-        content = file.read()
 
-    lines = content.splitlines()
+def get_book_tiddler_highlight_number(book_content: str) -> int:
     # takes the line corresponding to the nbr_of_highlights information
-    index, line = next(filter(lambda pair: 'nbr_of_highlights' in pair[1],
-                       enumerate(lines)))
-    new_highlight_count = int(line.split()[1]) + 1
-    new_lines = (lines[:index] +
-                 [f'nbr_of_highlights: {new_highlight_count}'] +
-                 lines[index + 1:])
-    with open(TIDDLERS_PATH + book_title + '.tid', 'w') as file:
-        content = file.write("\n".join(new_lines))
-    return new_highlight_count
+    line = next(filter(lambda line: 'nbr_of_highlights' in line,
+                       book_content.splitlines()))
+    return int(line.split()[1])
+
+
+def set_book_tiddler_highlight_number(book_content: str, highlight_count: int) -> str:
+    return "\n".join(f'nbr_of_highlights: {highlight_count}'
+                     if 'nbr_of_highlights' in line else line
+                     for line in book_content.splitlines())
+
+
+def read_book_tiddler_highlight_number(book_title: str) -> int:
+    """What the book tiddler's `nbr_of_highlights` says (0 if there's no book tiddler)"""
+    if not check_tiddler_exists(book_title):
+        return 0
+    with open(TIDDLERS_PATH + book_title + '.tid', 'r') as file:
+        return get_book_tiddler_highlight_number(file.read())
+
+
+def take_quote_order(book_title: str) -> int:
+    """The `quote-order` of a new quote of the book; the book tiddler's
+    `nbr_of_highlights` is only updated later (see `update_book_tiddlers`)"""
+    return take_quote_orders(book_title, 1, lambda: read_book_tiddler_highlight_number(book_title))[0]
+
+
+def update_book_tiddlers(workers: Optional[int] = None) -> list[str]:
+    """Rewrites, at once, the `nbr_of_highlights` of every book tiddler that
+    is behind the quote counters; returns the titles of the ones updated"""
+    updated, tiddlers = [], []
+    for book_title, quote_count in get_stale_book_tiddlers():
+        if not check_tiddler_exists(book_title):
+            continue
+        with open(TIDDLERS_PATH + book_title + '.tid', 'r') as file:
+            content = file.read()
+        tiddlers.append((book_title, set_book_tiddler_highlight_number(content, quote_count)))
+        updated.append((book_title, quote_count))
+    if tiddlers:
+        write_tiddlers(tiddlers, workers=workers)
+    for book_title, quote_count in updated:
+        mark_book_tiddler_updated(book_title, quote_count)
+    return [book_title for book_title, _ in updated]
 
 
 # 240322 - adds a book-quote tiddler by default
@@ -177,53 +302,89 @@ quote-order: {'0' if quote_order < 10 else ''}{str(quote_order)}
 """
 
 
+class HighlightIdRegistry:
+    """The ids of the highlights already turned into tiddlers, as recorded
+    in the EXISTING_IDS_FILE tiddler. The file is read once and kept as a set;
+    it is only read again if it changes on disk (eg. edited in TiddlyWiki)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._ids: set[str] = set()
+        self._stamp = None
+        self._lock = Lock()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _revalidate(self) -> None:
+        stamp = self._file_stamp()
+        if stamp == self._stamp:
+            return
+        if stamp is None:
+            logging.warning("Highlight ids record %s not found", self.path)
+            self._ids = set()
+        else:
+            with open(self.path, "r") as file:
+                self._ids = set(file.read().splitlines())
+        self._stamp = stamp
+
+    def __contains__(self, highlight_id: str) -> bool:
+        with self._lock:
+            self._revalidate()
+            return highlight_id in self._ids
+
+    def add(self, highlight_id: str) -> None:
+        """Doesn't check whether the highlight is already recorded!"""
+        self.add_many([highlight_id])
+
+    def add_many(self, highlight_ids: list[str]) -> None:
+        """Records several ids with a single write"""
+        if not highlight_ids:
+            return
+        with self._lock:
+            self._revalidate()
+            with open(self.path, "a") as file:
+                file.write(''.join('\n\n' + highlight_id + '\n\n'
+                                   for highlight_id in highlight_ids))
+            self._ids.update(highlight_ids)
+            self._stamp = self._file_stamp()
+
+
+highlight_id_registry = HighlightIdRegistry(TIDDLERS_PATH + EXISTING_IDS_FILE)
+
+
 def record_in_highlight_id(highlight_id: str) -> bool:
-    with open(TIDDLERS_PATH + EXISTING_IDS_FILE, "r") as file:
-        return highlight_id in file.read().splitlines()
+    return highlight_id in highlight_id_registry
 
 
 def add_highlight_id_to_record(highlight_id: str) -> None:
     """This function doesn't check whether the highlight already exists!"""
-    with open(TIDDLERS_PATH + EXISTING_IDS_FILE, "a") as file:
-        file.write('\n\n' + highlight_id + '\n\n')
+    highlight_id_registry.add(highlight_id)
+
+
+def add_highlight_ids_to_record(highlight_ids: list[str]) -> None:
+    """Records several highlights with a single write; doesn't check them either!"""
+    highlight_id_registry.add_many(highlight_ids)
 
 
 class TiddlerFilenameManager:
     def __init__(self):
-        self.mappings_file = Path(PAOGARDEN_DIR) / "book_metadata_mappings.txt"
-        # Create mappings file if it doesn't exist
-        self.mappings_file.touch(exist_ok=True)
-        self.metadata_cache = {}  # Initialize empty, will be loaded when needed
-
-    
-    def refresh_metadata(self) -> None:
-        """Reload metadata from file - call this when opening the modal"""
-        self.metadata_cache.clear()
-        with open(self.mappings_file, 'r') as f:
-            for line in f:
-                if line.strip():
-                    filename, title, author = line.strip().split('|')
-                    self.metadata_cache[self._clean_filename(filename)] = (title.strip(), author.strip())
-        logging.info("Refreshed book metadata from file")
+        self.mappings_file = Path(PAOGARDEN_DIR) / METADATA_MAPPINGS_FILE
+        # one store per file, shared by every manager (see `utils/metadata_mappings.py`)
+        self.store = get_metadata_mapping_store(str(self.mappings_file))
 
     def get_mapped_metadata(self, original_filename: str) -> Tuple[str, str]:
         """Get title and author from mappings file"""
-        clean_original = self._clean_filename(original_filename)
-        
-        with open(self.mappings_file, 'r') as f:
-            for line in f:
-                if line.strip():  # Skip empty lines
-                    filename, title, author = line.strip().split('|')
-                    if self._clean_filename(filename) == clean_original:
-                        return title.strip(), author.strip()
-        
-        # If no mapping found, return original parsed
-        return None, None
-    
+        # If no mapping found, (None, None)
+        return self.store.get(original_filename)
+
     def _clean_filename(self, filename: str) -> str:
-        """Remove extension and clean up the filename for comparison"""
-        return re.sub(r'[^\w\s-]', '', filename.replace('.epub', '').strip().lower())
-    
+        return clean_filename(filename)
+
     def _parse_original_name(self, original_name: str) -> Tuple[str, str]:
         """Parse original filename into title and author"""
         # Handle common filename patterns
@@ -245,26 +406,8 @@ class TiddlerFilenameManager:
         if check_tiddler_exists(title):
             raise TiddlerExistsError(f"Tiddler with title '{title}' already exists")
 
-        clean_original = self._clean_filename(original_filename)
-        current_mappings = []
-        
-        # Read existing mappings, excluding the one we're updating
-        if self.mappings_file.exists():
-            with open(self.mappings_file, 'r') as f:
-                for line in f:
-                    if line.strip():
-                        filename, _, _ = line.strip().split('|')
-                        if self._clean_filename(filename) != clean_original:
-                            current_mappings.append(line.strip())
-        
-        # Add the new mapping
-        current_mappings.append(f"{original_filename}|{title}|{author}")
-        
-        # Write all mappings back to file
-        with open(self.mappings_file, 'w') as f:
-            f.write('\n'.join(current_mappings) + '\n')
-        
-        logging.info(f"Updated metadata mapping for {original_filename}")
+        self.store.set(original_filename, title, author)
+        logging.info("Updated metadata mapping for %s", original_filename)
 
 class TiddlerError(Exception):
     """Base exception for tiddler-related errors"""
@@ -285,16 +428,17 @@ def create_highlight_tiddler(
         chapter: str = ""
         ) -> Optional[str]:
 
-    logging.debug(f"tiddler_title is {tiddler_title}")
+    logging.debug("tiddler_title is %s", tiddler_title)
     if check_tiddler_exists(tiddler_title):
         raise TiddlerExistsError(f"Tiddler with title '{tiddler_title}' already exists")
 
-    # Access or create book tiddler, and retrieve the `highlight_order`
-    if check_tiddler_exists(book_title):
-        highlight_order = increment_book_tiddler_highlight_number(book_title)
-    else:
+    # Retrieve the `highlight_order`, and create the book tiddler if needed
+    highlight_order = take_quote_order(book_title)
+    if not check_tiddler_exists(book_title):
         create_book_tiddler(book_title, book_author, book_filepath)
-        highlight_order = 1
+        # a new book tiddler starts with `nbr_of_highlights: 1`
+        if highlight_order == 1:
+            mark_book_tiddler_updated(book_title, 1)
 
     
     # Create tiddler content
@@ -308,13 +452,12 @@ def create_highlight_tiddler(
         chapter=chapter,
     )
 
-    logging.info(f"Created tiddler '{tiddler_title}' with highlight order {highlight_order}")
+    logging.info("Created tiddler '%s' with highlight order %s", tiddler_title, highlight_order)
     
     # Save tiddler
     try:
-        with open(Path(TIDDLERS_PATH) / (tiddler_title + '.tid'), 'w') as f:
-            f.write(content)
+        tiddler_directory_index.write(tiddler_title, content)
         return tiddler_title
     except Exception as e:
-        logging.error(f"Failed to create tiddler '{tiddler_title}': {e}")
+        logging.error("Failed to create tiddler '%s': %s", tiddler_title, e)
         return None
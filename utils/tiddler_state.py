@@ -0,0 +1,75 @@
+import sqlite3
+from typing import Callable
+from utils.const import TIDDLER_STATE_DB_PATH
+from utils.sqlite_pool import get_connection_pool
+
+# what kobogarden keeps about the tiddlers it wrote, next to the wiki;
+# for now, how many quotes each book has (which hands out `quote-order`),
+# and how many its book tiddler's `nbr_of_highlights` says it has.
+# Unlike the cache, this can't be rebuilt from the epubs; if the file is
+# lost, counters start again from what the book tiddlers say.
+TIDDLER_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS book_state (
+    book_title TEXT PRIMARY KEY,
+    quote_count INTEGER NOT NULL,
+    -- what `nbr_of_highlights` says in the book tiddler
+    tiddler_quote_count INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def _set_up_state(conn: sqlite3.Connection) -> None:
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(TIDDLER_STATE_SCHEMA)
+
+
+def borrow_state_connection():
+    """`with borrow_state_connection() as conn:` borrows a connection to the
+    state database from its pool (see `utils/sqlite_pool.py`)"""
+    return get_connection_pool(TIDDLER_STATE_DB_PATH, _set_up_state,
+                               timeout=30, isolation_level=None).connection()
+
+
+def take_quote_orders(
+        book_title: str,
+        amount: int,
+        current_count: Callable[[], int]
+        ) -> range:
+    """Hands out the next `amount` quote orders of a book; two writers
+    (threads or processes) never get the same one. The first time a book
+    is seen, its count starts from `current_count()` (what the book tiddler
+    says, if there is one)."""
+    with borrow_state_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT quote_count FROM book_state WHERE book_title = ?",
+                               (book_title,)).fetchone()
+            if row is None:
+                count = current_count()
+                conn.execute("INSERT INTO book_state VALUES (?, ?, ?)", (book_title, count, count))
+            else:
+                count = row[0]
+            conn.execute("UPDATE book_state SET quote_count = ? WHERE book_title = ?",
+                         (count + amount, book_title))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return range(count + 1, count + amount + 1)
+
+
+def get_stale_book_tiddlers() -> list[tuple[str, int]]:
+    """(book title, quote count) of the book tiddlers
+    whose `nbr_of_highlights` is behind"""
+    with borrow_state_connection() as conn:
+        return conn.execute("""
+            SELECT book_title, quote_count FROM book_state
+            WHERE quote_count != tiddler_quote_count
+        """).fetchall()
+
+
+def mark_book_tiddler_updated(book_title: str, quote_count: int) -> None:
+    with borrow_state_connection() as conn:
+        conn.execute("""
+            UPDATE book_state SET tiddler_quote_count = ? WHERE book_title = ?
+        """, (quote_count, book_title))
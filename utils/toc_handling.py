@@ -1,3 +1,9 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterator, Optional
+from urllib.parse import unquote
 from bs4 import BeautifulSoup
 from ebooklib import epub
 import re
@@ -7,11 +13,20 @@ from utils.const import (
 from utils.database import (
     get_highlight_from_database,
 )
+from utils.cache_store import (
+    get_highlight_location,
+    put_highlight_chapter,
+)
+from utils.epub_cache import get_epub_fingerprint, get_parsed_book
+from utils.epub_reader import get_epub_reader
+
+# chapter indexes of the most recently used books
+CHAPTER_INDEXES_MAX = 8
 
 
 def get_table_of_contents_from_epub(path: str):
     """"""
-    book = epub.read_epub(path, {'ignore_ncx': True})
+    book = get_parsed_book(path).book
     if not book:
         raise FileNotFoundError("The book doesn't seem to exist?")
     return book.toc
@@ -29,24 +44,98 @@ def retrieve_clean_href(href: str):
         return result[0] if result else None
 
 
-def get_dict_of_href_and_title_from_toc(toc):
-    all_refs = {}
+def iter_links_of_toc(toc) -> Iterator[epub.Link]:
+    """Every link of the TOC, however deep it is nested, in reading order"""
     for elem in toc:
         if isinstance(elem, epub.Link):
-            clean = retrieve_clean_href(elem.href)
-            if clean:
-                all_refs[clean] = elem.title
+            yield elem
         elif isinstance(elem, tuple):
-            if isinstance(elem[0], epub.Section):
-                for sub_elem in elem[1]:
-                    if isinstance(sub_elem, epub.Link):
-                        clean = retrieve_clean_href(sub_elem.href)
-                        if clean:
-                            all_refs[clean] = sub_elem.title
+            # (epub.Section, [children])
+            yield from iter_links_of_toc(elem[1])
+        elif isinstance(elem, list):
+            yield from iter_links_of_toc(elem)
+
 
+def get_dict_of_href_and_title_from_toc(toc):
+    all_refs = {}
+    for link in iter_links_of_toc(toc):
+        clean = retrieve_clean_href(link.href)
+        if clean:
+            all_refs[clean] = link.title
     return all_refs
 
 
+def _path_suffixes(path: str) -> list[str]:
+    """'OEBPS/xhtml/c01.xhtml' -> ['OEBPS/xhtml/c01.xhtml', 'xhtml/c01.xhtml', 'c01.xhtml']"""
+    parts = unquote(path).split('/')
+    return ['/'.join(parts[i:]) for i in range(len(parts))]
+
+
+class ChapterIndex:
+    """Maps sections of a book to the chapter they are in; built once per book.
+    Sections in the TOC are looked up directly. Any other section of the spine
+    belongs to the closest TOC entry before it in reading order, found by
+    bisecting the spine positions where chapters start."""
+
+    def __init__(self, toc, spine: Optional[list[str]] = None):
+        self.chapters = get_dict_of_href_and_title_from_toc(toc)
+        self._sorted_hrefs = sorted(self.chapters)
+        self._spine_position = {}
+        for position, href in enumerate(spine or []):
+            for suffix in _path_suffixes(href):
+                self._spine_position.setdefault(suffix, position)
+        starts = {}
+        for href, title in self.chapters.items():
+            position = self._find_in_spine(href)
+            if position is not None:
+                starts[position] = title
+        self._starts = array('I', sorted(starts))
+        self._titles = [starts[position] for position in self._starts]
+
+    def _find_in_spine(self, path: str) -> Optional[int]:
+        for suffix in _path_suffixes(path):
+            if suffix in self._spine_position:
+                return self._spine_position[suffix]
+        return None
+
+    def chapter_of(self, section: str) -> Optional[str]:
+        """`section` might be a Kobo container path, eg.
+        `OEBPS/xhtml/c01.xhtml#point(/1/4/22/4:478)`"""
+        for suffix in _path_suffixes(section.split('#')[0]):
+            if suffix in self.chapters:
+                return self.chapters[suffix]
+        position = self._find_in_spine(section.split('#')[0])
+        if position is not None and self._starts:
+            i = bisect_right(self._starts, position) - 1
+            return self._titles[i] if i >= 0 else None
+        # 24/04/17: without a spine to go by, the preceding chapter
+        # is the one whose href sorts right before the section
+        clean_section = retrieve_clean_href(section) or section.split('#')[0]
+        i = bisect_left(self._sorted_hrefs, clean_section) - 1
+        return self.chapters[self._sorted_hrefs[i]] if i >= 0 else None
+
+
+_chapter_indexes: OrderedDict[tuple, ChapterIndex] = OrderedDict()
+_chapter_indexes_lock = Lock()
+
+
+def get_chapter_index(book_path: str) -> ChapterIndex:
+    """The chapter index of a book, from its TOC and spine order"""
+    key = (book_path, get_epub_fingerprint(book_path))
+    with _chapter_indexes_lock:
+        index = _chapter_indexes.get(key)
+        if index is not None:
+            _chapter_indexes.move_to_end(key)
+            return index
+    index = ChapterIndex(get_table_of_contents_from_epub(book_path),
+                         get_epub_reader(book_path).spine)
+    with _chapter_indexes_lock:
+        _chapter_indexes[key] = index
+        while len(_chapter_indexes) > CHAPTER_INDEXES_MAX:
+            _chapter_indexes.popitem(last=False)
+    return index
+
+
 # retrieves the preceding chapter from the table of contents
 def get_previous_chapter_from_section(section: str, toc: dict) -> str:
     sorted_toc_sections = sorted(list(toc.keys()) + [section])
@@ -55,16 +144,23 @@ def get_previous_chapter_from_section(section: str, toc: dict) -> str:
 
 
 def match_highlight_section_to_chapter(section: str, toc) -> str | None:
-    href_title_dict = get_dict_of_href_and_title_from_toc(toc)
-    # 24/08/08: for STRANGERS, the section needed the OEBPS
-    if '#' in section:
-        split_section = section.split('#')[0]
-        if split_section in href_title_dict.keys():
-            return href_title_dict[split_section]
-    clean_section = retrieve_clean_href(section)
-    if clean_section in href_title_dict.keys():
-        return href_title_dict[clean_section]
-    # 24/04/17: if the section is not in the TOC, we try to map
-    # to the preceding chapter
-    else:
-        return href_title_dict[get_previous_chapter_from_section(clean_section, href_title_dict)]
+    """`toc` is either the book's TOC or its `ChapterIndex`"""
+    index = toc if isinstance(toc, ChapterIndex) else ChapterIndex(toc)
+    return index.chapter_of(section)
+
+
+# the chapter of a highlight is resolved once per version of the epub,
+# and then kept in the cache database; the TOC is only read on a miss.
+def get_chapter_of_highlight(
+        highlight_id: str,
+        section: str,
+        book_path: str,
+        toc=None) -> str | None:
+    fingerprint = get_epub_fingerprint(book_path)
+    location = get_highlight_location(highlight_id, fingerprint)
+    if location is not None and location.chapter is not None:
+        return location.chapter or None
+    chapter = match_highlight_section_to_chapter(
+            section, toc if toc is not None else get_chapter_index(book_path))
+    put_highlight_chapter(highlight_id, fingerprint, chapter)
+    return chapter